@@ -1,20 +1,30 @@
+import io
 import os
-import uuid
+import csv
 import json
+import uuid
+import time
+import base64
+import mimetypes
 import urllib.parse
-import urllib.request
+import click
 from functools import wraps
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, jsonify, url_for, session
-from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, redirect, jsonify, url_for, session, send_from_directory, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from database import (
     create_tables,
     insert_post,
-    get_posts,
+    insert_posts,
+    get_posts_page,
+    search_posts,
+    get_calendar,
     delete_post,
     get_counts,
+    get_last_post_event_id,
+    get_post_events,
     get_post,
+    get_post_attempts,
     update_post,
     create_user,
     get_user_by_email,
@@ -22,44 +32,211 @@ from database import (
     add_account,
     get_accounts,
     delete_account,
-    get_account_by_id
+    get_account_by_id,
+    rebuild_counters,
+    verify_counters,
+    compact_database,
+    normalize_datetime
 )
-from scheduler import schedule_post, cancel_post
+from http_client import get_json as http_get_json, post_form as http_post_json
+from metrics import http_request_seconds, render as render_metrics
+from storage import UPLOAD_FOLDER, store_upload
+from images import generate_renditions
+from events import (
+    EVENTS_QUEUE_SIZE,
+    event_to_dict,
+    stream as event_stream,
+    subscribe as subscribe_events,
+    unsubscribe as unsubscribe_events,
+    wake as wake_events
+)
+from scheduler import schedule_post, schedule_posts, cancel_post, start_scheduler
+from workers import stats as publisher_stats
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 create_tables()
-app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "static", "uploads")
+app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024
 
 ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+POSTS_PAGE_SIZE = int(os.environ.get("POSTS_PAGE_SIZE", "30"))
+MAX_POSTS_PAGE_SIZE = 200
+MAX_IMPORT_ROWS = int(os.environ.get("MAX_IMPORT_ROWS", "20000"))
+POST_TYPES = {"Feed", "Story", "Reels"}
+IMPORT_FIELDS = ("client", "post_type", "caption", "image_url", "scheduled_at", "account_id")
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "0"))
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+CALENDAR_MAX_DAYS = {"day": 366, "hour": 31}
 FB_APP_ID = os.environ.get("FB_APP_ID")
 FB_APP_SECRET = os.environ.get("FB_APP_SECRET")
 FB_REDIRECT_URI = os.environ.get("FB_REDIRECT_URI")
 FB_SCOPE = "instagram_basic,instagram_content_publish,pages_read_engagement"
 
+def serve_static(filename):
+    if filename.startswith("uploads/"):
+        response = send_from_directory(app.static_folder, filename, max_age=UPLOAD_MAX_AGE, conditional=True, etag=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    response = None
+    path = os.path.join(app.static_folder, filename)
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        compressed = path + suffix
+        if not request.accept_encodings[encoding] or not os.path.isfile(compressed):
+            continue
+        if os.path.isfile(path) and os.path.getmtime(compressed) < os.path.getmtime(path):
+            continue
+        response = send_from_directory(
+            app.static_folder,
+            filename + suffix,
+            mimetype=mimetypes.guess_type(filename)[0],
+            max_age=STATIC_MAX_AGE,
+            conditional=True,
+            etag=True
+        )
+        response.headers["Content-Encoding"] = encoding
+        break
+    if response is None:
+        response = send_from_directory(app.static_folder, filename, max_age=STATIC_MAX_AGE, conditional=True, etag=True)
+    response.vary.add("Accept-Encoding")
+    if not STATIC_MAX_AGE:
+        response.cache_control.no_cache = True
+    return response
+
+app.view_functions["static"] = serve_static
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get("request_started")
+    if started is not None:
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            request.endpoint or "unknown",
+            request.method,
+            str(response.status_code)
+        )
+    return response
+
 def save_upload(file):
     if not file or file.filename == "":
         return None
     _, ext = os.path.splitext(file.filename.lower())
     if ext not in ALLOWED_EXTENSIONS:
         return None
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-    safe_name = secure_filename(file.filename)
-    filename = f"{uuid.uuid4().hex}_{safe_name}"
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(file_path)
-    return url_for("static", filename=f"uploads/{filename}")
-
-def http_get_json(url):
-    with urllib.request.urlopen(url) as resp:
-        return json.loads(resp.read().decode("utf-8"))
-
-def http_post_json(url, data):
-    payload = urllib.parse.urlencode(data).encode("utf-8")
-    req = urllib.request.Request(url, data=payload)
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    build_url = lambda filename: url_for("static", filename=f"uploads/{filename}")
+    sha256, filename, url = store_upload(file.stream, ext, build_url)
+    generate_renditions(sha256, filename, build_url)
+    return url
+
+def request_cached(fn, *args):
+    memo = g.setdefault("db_memo", {})
+    key = (fn.__name__,) + args
+    if key not in memo:
+        memo[key] = fn(*args)
+    return memo[key]
+
+def post_to_dict(post, history=None):
+    data = {
+        "id": post[0],
+        "client": post[1],
+        "post_type": post[2],
+        "caption": post[3],
+        "image_url": post[4],
+        "scheduled_at": post[5],
+        "status": post[6],
+        "account_id": post[7] if len(post) > 7 else None,
+        "thumb_url": post[13] if len(post) > 13 else None,
+        "attempts": post[14] if len(post) > 14 else 0,
+        "next_attempt_at": post[15] if len(post) > 15 else None,
+        "last_error": post[16] if len(post) > 16 else None
+    }
+    if history is not None:
+        data["history"] = [
+            {"attempted_at": attempted_at, "decision": decision, "error": error, "retry_after": retry_after}
+            for attempted_at, decision, error, retry_after in history
+        ]
+    return data
+
+def encode_cursor(post):
+    return base64.urlsafe_b64encode(f"{post[5]}|{post[0]}".encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    scheduled_at, _, post_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rpartition("|")
+    return scheduled_at, int(post_id)
+
+def load_posts_page(user_id, args):
+    try:
+        limit = min(max(int(args.get("limit") or POSTS_PAGE_SIZE), 1), MAX_POSTS_PAGE_SIZE)
+        after = decode_cursor(args["cursor"]) if args.get("cursor") else None
+        account_id = int(args["account_id"]) if args.get("account_id") else None
+    except (TypeError, ValueError):
+        raise ValueError("Parâmetros de paginação inválidos.")
+    date_to = (args.get("to") or "").strip() or None
+    if date_to and len(date_to) == 10:
+        date_to += "T23:59:59"
+    posts = get_posts_page(
+        user_id,
+        after=after,
+        limit=limit + 1,
+        status=(args.get("status") or "").strip() or None,
+        account_id=account_id,
+        date_from=(args.get("from") or "").strip() or None,
+        date_to=date_to
+    )
+    next_cursor = encode_cursor(posts[limit - 1]) if len(posts) > limit else None
+    return posts[:limit], next_cursor
+
+def read_import_rows():
+    upload = request.files.get("file")
+    if upload and upload.filename.lower().endswith(".csv"):
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig")
+        return list(csv.DictReader(stream))
+    if upload:
+        payload = json.load(upload.stream)
+    else:
+        payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get("posts")
+    if not isinstance(payload, list):
+        raise ValueError("Envie um CSV ou uma lista JSON de posts.")
+    return payload
+
+def validate_import_row(row, account_ids):
+    if not isinstance(row, dict):
+        raise ValueError("Linha deve ser um objeto.")
+    values = {field: ("" if row.get(field) is None else str(row.get(field)).strip()) for field in IMPORT_FIELDS}
+    if not values["client"]:
+        raise ValueError("client obrigatório.")
+    if values["post_type"] not in POST_TYPES:
+        raise ValueError("post_type deve ser Feed, Story ou Reels.")
+    try:
+        scheduled_at = normalize_datetime(values["scheduled_at"])
+    except ValueError:
+        raise ValueError("scheduled_at inválido. Use ISO 8601.")
+    account_id = None
+    if values["account_id"]:
+        try:
+            account_id = int(values["account_id"])
+        except ValueError:
+            raise ValueError("account_id inválido.")
+        if account_id not in account_ids:
+            raise ValueError("Conta inválida.")
+    return {
+        "client": values["client"],
+        "post_type": values["post_type"],
+        "caption": values["caption"],
+        "image_url": values["image_url"] or None,
+        "scheduled_at": scheduled_at,
+        "account_id": account_id,
+        "user_id": session.get("user_id")
+    }
 
 def login_required(fn):
     @wraps(fn)
@@ -69,16 +246,35 @@ def login_required(fn):
         return fn(*args, **kwargs)
     return wrapper
 
+@app.cli.command("compact")
+def compact_command():
+    compact_database(full=True)
+    click.echo("Banco compactado.")
+
+@app.cli.command("counters")
+@click.argument("action", type=click.Choice(["verify", "rebuild"]))
+def counters_command(action):
+    if action == "rebuild":
+        rebuild_counters()
+        click.echo("Contadores reconstruídos.")
+        return
+    drift = verify_counters()
+    for user_id, account_id, status, expected, actual in drift:
+        click.echo(f"user={user_id} account={account_id} status={status!r}: esperado {expected}, atual {actual}")
+    if drift:
+        raise SystemExit(1)
+    click.echo("Contadores consistentes.")
+
 def run_app():
+    start_scheduler(debug=True)
     app.run(debug=True)
 
 @app.route("/", methods=["GET", "POST"])
 @login_required
 def dashboard():
     if request.method == "POST":
-        scheduled_at = request.form.get("scheduled_at", "").strip()
         try:
-            datetime.fromisoformat(scheduled_at)
+            scheduled_at = normalize_datetime(request.form.get("scheduled_at", "").strip())
         except ValueError:
             return jsonify({"error": "scheduled_at inválido. Use ISO 8601."}), 400
 
@@ -88,7 +284,7 @@ def dashboard():
             image_url = uploaded_url
         account_id = request.form.get("account_id")
         if account_id:
-            account = get_account_by_id(session.get("user_id"), int(account_id))
+            account = request_cached(get_account_by_id, session.get("user_id"), int(account_id))
             if not account:
                 return jsonify({"error": "Conta inválida"}), 400
 
@@ -106,10 +302,95 @@ def dashboard():
         schedule_post(post_id, data)
         return redirect("/")
 
-    posts = get_posts(session.get("user_id"))
+    posts, next_cursor = load_posts_page(session.get("user_id"), {})
     counts = get_counts(session.get("user_id"))
-    accounts = get_accounts(session.get("user_id"))
-    return render_template("dashboard.html", posts=posts, counts=counts, accounts=accounts, user=get_user_by_id(session.get("user_id")))
+    accounts = request_cached(get_accounts, session.get("user_id"))
+    return render_template(
+        "dashboard.html",
+        posts=posts,
+        next_cursor=next_cursor,
+        counts=counts,
+        last_event_id=get_last_post_event_id(session.get("user_id")),
+        accounts=accounts,
+        user=request_cached(get_user_by_id, session.get("user_id"))
+    )
+
+@app.route("/api/posts")
+@login_required
+def posts_api():
+    try:
+        posts, next_cursor = load_posts_page(session.get("user_id"), request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify({"posts": [post_to_dict(post) for post in posts], "next_cursor": next_cursor})
+
+@app.route("/api/posts/search")
+@login_required
+def posts_search_api():
+    try:
+        limit = min(max(int(request.args.get("limit") or POSTS_PAGE_SIZE), 1), MAX_POSTS_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Parâmetro limit inválido."}), 400
+    posts = search_posts(session.get("user_id"), request.args.get("q", ""), limit)
+    return jsonify({"posts": [post_to_dict(post) for post in posts]})
+
+@app.route("/api/calendar")
+@login_required
+def calendar_api():
+    bucket = request.args.get("bucket", "day")
+    try:
+        date_from = datetime.fromisoformat(request.args["from"])
+        date_to = datetime.fromisoformat(request.args["to"]) + timedelta(days=1)
+        account_id = int(request.args["account_id"]) if request.args.get("account_id") else None
+    except (KeyError, ValueError):
+        return jsonify({"error": "Informe from e to no formato AAAA-MM-DD."}), 400
+    if bucket not in CALENDAR_MAX_DAYS:
+        return jsonify({"error": "bucket deve ser day ou hour."}), 400
+    if not date_from < date_to <= date_from + timedelta(days=CALENDAR_MAX_DAYS[bucket]):
+        return jsonify({"error": f"Intervalo máximo de {CALENDAR_MAX_DAYS[bucket]} dias."}), 400
+
+    rows = get_calendar(
+        session.get("user_id"),
+        date_from.date().isoformat(),
+        date_to.date().isoformat(),
+        bucket,
+        account_id
+    )
+    buckets = {}
+    for key, row_account_id, status, count in rows:
+        entry = buckets.setdefault(key, {"key": key, "total": 0, "statuses": {}, "accounts": {}})
+        entry["total"] += count
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + count
+        statuses = entry["accounts"].setdefault(str(row_account_id or ""), {})
+        statuses[status] = statuses.get(status, 0) + count
+    return jsonify({"bucket": bucket, "buckets": list(buckets.values())})
+
+@app.route("/posts/import", methods=["POST"])
+@login_required
+def import_posts():
+    try:
+        rows = read_import_rows()
+    except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+        return jsonify({"error": str(exc)}), 400
+    if not rows:
+        return jsonify({"error": "Nenhum post para importar."}), 400
+    if len(rows) > MAX_IMPORT_ROWS:
+        return jsonify({"error": f"Máximo de {MAX_IMPORT_ROWS} posts por importação."}), 400
+
+    account_ids = {account[0] for account in request_cached(get_accounts, session.get("user_id"))}
+    posts = []
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            posts.append(validate_import_row(row, account_ids))
+        except ValueError as exc:
+            errors.append({"row": number, "error": str(exc)})
+    if errors:
+        return jsonify({"inserted": 0, "errors": errors}), 400
+
+    post_ids = insert_posts(posts)
+    schedule_posts(list(zip(post_ids, posts)))
+    return jsonify({"inserted": len(post_ids), "errors": []}), 201
 
 @app.route("/delete/<int:post_id>", methods=["DELETE"])
 @login_required
@@ -118,6 +399,7 @@ def delete(post_id):
     deleted = delete_post(session.get("user_id"), post_id)
     if deleted == 0:
         return jsonify({"success": False, "error": "Post não encontrado"}), 404
+    wake_events()
     return jsonify({"success": True})
 
 @app.route("/post/<int:post_id>", methods=["GET", "PUT"])
@@ -127,16 +409,7 @@ def post_detail(post_id):
         post = get_post(session.get("user_id"), post_id)
         if not post:
             return jsonify({"error": "Post não encontrado"}), 404
-        return jsonify({
-            "id": post[0],
-            "client": post[1],
-            "post_type": post[2],
-            "caption": post[3],
-            "image_url": post[4],
-            "scheduled_at": post[5],
-            "status": post[6],
-            "account_id": post[7] if len(post) > 7 else None
-        })
+        return jsonify(post_to_dict(post, get_post_attempts(post_id)))
 
     if request.is_json:
         payload = request.get_json(silent=True) or {}
@@ -153,9 +426,8 @@ def post_detail(post_id):
         form_data = request.form
         image_file = request.files.get("image_file")
 
-    scheduled_at = (form_data.get("scheduled_at") or "").strip()
     try:
-        datetime.fromisoformat(scheduled_at)
+        scheduled_at = normalize_datetime((form_data.get("scheduled_at") or "").strip())
     except ValueError:
         return jsonify({"error": "scheduled_at inválido. Use ISO 8601."}), 400
 
@@ -166,7 +438,7 @@ def post_detail(post_id):
 
     account_id = form_data.get("account_id")
     if account_id:
-        account = get_account_by_id(session.get("user_id"), int(account_id))
+        account = request_cached(get_account_by_id, session.get("user_id"), int(account_id))
         if not account:
             return jsonify({"error": "Conta inválida"}), 400
 
@@ -183,8 +455,52 @@ def post_detail(post_id):
         return jsonify({"error": "Post não encontrado"}), 404
     cancel_post(post_id)
     schedule_post(post_id, data)
+    wake_events()
     return jsonify({"success": True})
 
+@app.route("/events")
+@login_required
+def events():
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID") or request.args["last_event_id"])
+    except (KeyError, ValueError):
+        last_event_id = None
+    user_id = session.get("user_id")
+    subscriber = subscribe_events(user_id)
+    if subscriber is None:
+        return jsonify({"error": "Muitas conexões abertas, tente novamente."}), 503
+    response = Response(
+        event_stream(user_id, subscriber, last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(lambda: unsubscribe_events(user_id, subscriber))
+    return response
+
+@app.route("/api/events")
+@login_required
+def events_api():
+    try:
+        after = int(request.args.get("after") or 0)
+    except ValueError:
+        return jsonify({"error": "Parâmetro after inválido."}), 400
+    rows = get_post_events(after, EVENTS_QUEUE_SIZE, session.get("user_id"))
+    return jsonify({"events": [event_to_dict(row) for row in rows]})
+
+@app.route("/api/counts")
+@login_required
+def counts_api():
+    return jsonify(get_counts(session.get("user_id")))
+
+@app.route("/publisher/stats")
+@login_required
+def publisher_status():
+    return jsonify(publisher_stats(session.get("user_id")))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -222,7 +538,7 @@ def logout():
 @app.route("/profile")
 @login_required
 def profile():
-    user = get_user_by_id(session.get("user_id"))
+    user = request_cached(get_user_by_id, session.get("user_id"))
     return render_template("profile.html", user=user)
 
 @app.route("/accounts", methods=["GET", "POST"])
@@ -236,7 +552,7 @@ def accounts():
         if not client_name or not ig_user_id or not access_token:
             return render_template(
                 "accounts.html",
-                accounts=get_accounts(session.get("user_id")),
+                accounts=request_cached(get_accounts, session.get("user_id")),
                 error="Preencha nome, IG User ID e Access Token."
             )
         add_account({
@@ -247,7 +563,7 @@ def accounts():
             "token_expires_at": token_expires_at
         })
         return redirect("/accounts")
-    return render_template("accounts.html", accounts=get_accounts(session.get("user_id")))
+    return render_template("accounts.html", accounts=request_cached(get_accounts, session.get("user_id")))
 
 @app.route("/accounts/delete/<int:account_id>", methods=["POST"])
 @login_required
@@ -263,7 +579,7 @@ def instagram_oauth_start():
     if not FB_APP_ID or not FB_REDIRECT_URI:
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Configure FB_APP_ID e FB_REDIRECT_URI no .env."
         )
     state = uuid.uuid4().hex
@@ -283,7 +599,7 @@ def instagram_oauth_callback():
     if request.args.get("error"):
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Autorização negada."
         )
     code = request.args.get("code")
@@ -291,13 +607,13 @@ def instagram_oauth_callback():
     if not code or state != session.get("oauth_state"):
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Estado de OAuth inválido."
         )
     if not FB_APP_ID or not FB_APP_SECRET or not FB_REDIRECT_URI:
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Configure FB_APP_ID, FB_APP_SECRET e FB_REDIRECT_URI no .env."
         )
 
@@ -313,7 +629,7 @@ def instagram_oauth_callback():
     if not short_token:
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Falha ao obter access token."
         )
 
@@ -330,7 +646,7 @@ def instagram_oauth_callback():
     if not access_token:
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Falha ao gerar token de longa duração."
         )
 
@@ -353,7 +669,7 @@ def instagram_oauth_callback():
     if not ig_accounts:
         return render_template(
             "accounts.html",
-            accounts=get_accounts(session.get("user_id")),
+            accounts=request_cached(get_accounts, session.get("user_id")),
             error="Nenhuma conta Instagram Business/Creator vinculada a esta página."
         )
 
@@ -0,0 +1,208 @@
+import os
+import ssl
+import gzip
+import json
+import time
+import asyncio
+import urllib.parse
+from database import get_posts_for_publish, mark_accounts_token_invalid, mark_posts_published
+from http_client import HTTP_TIMEOUT, observe_response, response_error
+from metrics import publish_lag_seconds, publish_total
+from publisher import GRAPH_API_BASE, container_expiry_cutoff, publish_lags, _lag_seconds
+from ratelimit import limiter
+from retry import record_failures
+from tokens import TokenInvalidError, is_token_error, mark_dead, token_problem
+
+ASYNC_CONCURRENCY = int(os.environ.get("ASYNC_CONCURRENCY", "200"))
+ASYNC_STATUS_BATCH = int(os.environ.get("ASYNC_STATUS_BATCH", "200"))
+
+class AsyncHttpPool:
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self._idle = {}
+        self._ssl = ssl.create_default_context()
+
+    async def _acquire(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+        scheme, host, port = key
+        use_ssl = scheme == "https"
+        port = port or (443 if use_ssl else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if use_ssl else None),
+            self.timeout
+        )
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        self._idle.setdefault(key, []).append((reader, writer))
+
+    async def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    async def request(self, method, url, body=b"", headers=None):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            "Accept-Encoding: gzip",
+            "Connection: keep-alive",
+            f"Content-Length: {len(body)}"
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        raw = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+        started = time.perf_counter()
+
+        while True:
+            reader, writer, reused = await self._acquire(key)
+            try:
+                writer.write(raw)
+                await writer.drain()
+                status, resp_headers, data = await asyncio.wait_for(self._read_response(reader), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                writer.close()
+                if reused:
+                    continue
+                observe_response(parts.hostname, "error", started)
+                raise
+            except BaseException:
+                writer.close()
+                observe_response(parts.hostname, "error", started)
+                raise
+            break
+        observe_response(parts.hostname, str(status), started)
+
+        if resp_headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._release(key, reader, writer)
+        if resp_headers.get("content-encoding", "").lower() == "gzip":
+            data = gzip.decompress(data)
+        if status >= 400:
+            raise response_error(status, data, resp_headers)
+        return data
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            return status, headers, b"".join(chunks)
+        if "content-length" in headers:
+            return status, headers, await reader.readexactly(int(headers["content-length"]))
+        headers["connection"] = "close"
+        return status, headers, await reader.read()
+
+    async def post_form(self, url, data):
+        payload = urllib.parse.urlencode(data).encode("utf-8")
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        return json.loads((await self.request("POST", url, payload, headers)).decode("utf-8"))
+
+async def _publish_one(pool, semaphore, post, expiry_cutoff):
+    (post_id, caption, image_url, account_id, scheduled_at, creation_id, staged_at,
+     ig_user_id, access_token, attempts, token_expires_at, _, token_invalid_at) = post
+    if not account_id or ig_user_id is None:
+        return
+    if not image_url:
+        raise ValueError("Post sem image_url")
+    if not ig_user_id or not access_token:
+        raise ValueError("Conta sem ig_user_id/access_token")
+    if token_invalid_at:
+        raise TokenInvalidError(f"Token invalidado em {token_invalid_at}; reconecte a conta")
+    problem = token_problem(access_token, token_expires_at)
+    if problem:
+        raise TokenInvalidError(problem)
+
+    while True:
+        wait = limiter.take(ig_user_id)
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+
+    async with semaphore:
+        if not creation_id or not staged_at or staged_at < expiry_cutoff:
+            container = await pool.post_form(
+                f"{GRAPH_API_BASE}/{ig_user_id}/media",
+                {"image_url": image_url, "caption": caption or "", "access_token": access_token}
+            )
+            creation_id = container.get("id")
+            if not creation_id:
+                raise ValueError("Falha ao criar container")
+        await pool.post_form(
+            f"{GRAPH_API_BASE}/{ig_user_id}/media_publish",
+            {"creation_id": creation_id, "access_token": access_token}
+        )
+
+async def _publish_all(post_ids, concurrency):
+    loop = asyncio.get_running_loop()
+    posts = []
+    for start in range(0, len(post_ids), 500):
+        posts += await loop.run_in_executor(None, get_posts_for_publish, post_ids[start:start + 500])
+    pool = AsyncHttpPool()
+    semaphore = asyncio.Semaphore(concurrency)
+    expiry_cutoff = container_expiry_cutoff()
+    published = []
+    failed = []
+
+    async def flush(final=False):
+        if published and (final or len(published) >= ASYNC_STATUS_BATCH):
+            batch = published[:]
+            published.clear()
+            await loop.run_in_executor(None, mark_posts_published, batch)
+        if failed and (final or len(failed) >= ASYNC_STATUS_BATCH):
+            batch = failed[:]
+            failed.clear()
+            await loop.run_in_executor(None, record_failures, batch)
+
+    async def run(post):
+        try:
+            await _publish_one(pool, semaphore, post, expiry_cutoff)
+        except Exception as exc:
+            if is_token_error(exc):
+                mark_dead(post[8], str(exc))
+                await loop.run_in_executor(None, mark_accounts_token_invalid, [post[3]])
+            failed.append((post[0], post[9], post[3], post[7], exc))
+            publish_total.inc("failed")
+        else:
+            published.append(post[0])
+            publish_total.inc("published")
+            lag = _lag_seconds(post[4])
+            if lag is not None:
+                publish_lags.append((post[0], lag, post[11]))
+                publish_lag_seconds.observe(max(lag, 0))
+        await flush()
+
+    try:
+        await asyncio.gather(*(run(post) for post in posts))
+        await flush(final=True)
+    finally:
+        await pool.close()
+
+def publish_posts(post_ids, concurrency=None):
+    if not post_ids:
+        return
+    asyncio.run(_publish_all(list(post_ids), concurrency or ASYNC_CONCURRENCY))
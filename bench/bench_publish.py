@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_graph import start_stub
+
+def seed(database, posts, accounts):
+    account_ids = [
+        database.add_account({
+            "user_id": 1,
+            "client_name": f"Cliente {i}",
+            "ig_user_id": f"ig{i}",
+            "access_token": f"token{i}"
+        })
+        for i in range(accounts)
+    ]
+    scheduled_at = (datetime.now() - timedelta(seconds=1)).isoformat(timespec="seconds")
+    conn = database.connect()
+    conn.executemany("""
+        INSERT INTO posts (client, post_type, caption, image_url, scheduled_at, status, account_id, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        ("Bench", "Feed", f"Post {i}", "https://example.com/image.jpg", scheduled_at, "Agendado",
+         account_ids[i % accounts], 1)
+        for i in range(posts)
+    ])
+    conn.commit()
+    conn.close()
+
+def claim_all(database, posts):
+    now = datetime.now().isoformat(timespec="seconds")
+    post_ids = []
+    while len(post_ids) < posts:
+        batch = database.claim_due_posts(now, 1000)
+        if not batch:
+            break
+        post_ids += batch
+    return post_ids
+
+def reset(database):
+    conn = database.connect()
+    conn.execute("UPDATE posts SET status = ?, claimed_at = NULL", ("Agendado",))
+    conn.commit()
+    conn.close()
+
+def count_published(database):
+    conn = database.connect()
+    published = conn.execute("SELECT COUNT(*) FROM posts WHERE status = ?", ("Publicado",)).fetchone()[0]
+    conn.close()
+    return published
+
+def run_threaded(database, publisher, posts, workers):
+    post_ids = claim_all(database, posts)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(publisher.publish_post, post_ids))
+    return time.perf_counter() - started
+
+def run_async(database, async_publisher, posts, concurrency):
+    post_ids = claim_all(database, posts)
+    started = time.perf_counter()
+    async_publisher.publish_posts(post_ids, concurrency=concurrency)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara o publicador em threads com o motor asyncio")
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    stub = start_stub(latency=args.latency)
+    os.environ["GRAPH_API_BASE"] = stub.base_url
+    os.environ["PRESTAGE_MINUTES"] = "0"
+    os.environ["ACCOUNT_RATE_PER_MINUTE"] = "1000000"
+    os.environ["ACCOUNT_BURST"] = "1000000"
+
+    import database
+    database.DB = os.path.join(tempfile.mkdtemp(prefix="instaschedule-bench-"), "bench.db")
+    database.create_tables()
+    import publisher
+    import async_publisher
+
+    seed(database, args.posts, args.accounts)
+    results = {"posts": args.posts, "accounts": args.accounts, "latency": args.latency}
+
+    elapsed = run_threaded(database, publisher, args.posts, args.workers)
+    results["threads"] = {
+        "workers": args.workers,
+        "seconds": round(elapsed, 3),
+        "posts_per_second": round(args.posts / elapsed, 1),
+        "published": count_published(database)
+    }
+
+    reset(database)
+    elapsed = run_async(database, async_publisher, args.posts, args.concurrency)
+    results["async"] = {
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "posts_per_second": round(args.posts / elapsed, 1),
+        "published": count_published(database)
+    }
+
+    stub.shutdown()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
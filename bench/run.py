@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_graph import start_stub
+
+PRESETS = {"small": 10000, "medium": 100000, "large": 1000000}
+SEARCH_TERMS = ("promo", "#verão", "lancamento frete", "campanha1", "bastidores café")
+
+LOWER_IS_BETTER = ("_ms", "_seconds", "lag")
+HIGHER_IS_BETTER = ("per_second",)
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+def timed_samples(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def bench_queries(database, user_ids, iterations, rng):
+    results = {}
+    results["get_posts_page_first"] = percentiles(timed_samples(
+        lambda: database.get_posts_page(rng.choice(user_ids), limit=30), iterations
+    ))
+
+    def deep_page():
+        user_id = rng.choice(user_ids)
+        page = database.get_posts_page(user_id, limit=200)
+        if page:
+            database.get_posts_page(user_id, after=(page[-1][5], page[-1][0]), limit=30)
+    results["get_posts_page_deep"] = percentiles(timed_samples(deep_page, iterations))
+
+    results["get_posts_page_filtered"] = percentiles(timed_samples(
+        lambda: database.get_posts_page(rng.choice(user_ids), limit=30, status="Publicado"), iterations
+    ))
+    results["search_posts"] = percentiles(timed_samples(
+        lambda: database.search_posts(rng.choice(user_ids), rng.choice(SEARCH_TERMS)), iterations
+    ))
+    results["get_counts"] = percentiles(timed_samples(
+        lambda: database.get_counts(rng.choice(user_ids)), iterations
+    ))
+    results["get_posts_full"] = percentiles(timed_samples(
+        lambda: database.get_posts(rng.choice(user_ids)), max(1, iterations // 10)
+    ))
+    return results
+
+def bench_dashboard(user_ids, iterations, rng):
+    try:
+        import app as webapp
+    except ImportError as exc:
+        return {"skipped": f"Flask indisponível: {exc}"}
+    client = webapp.app.test_client()
+
+    def load():
+        with client.session_transaction() as flask_session:
+            flask_session["user_id"] = rng.choice(user_ids)
+        response = client.get("/")
+        if response.status_code != 200:
+            raise RuntimeError(f"dashboard respondeu {response.status_code}")
+    return percentiles(timed_samples(load, iterations))
+
+def insert_due_posts(database, accounts, count, scheduled_at, rng):
+    posts = []
+    for i in range(count):
+        user_id, account_id = accounts[rng.randrange(len(accounts))]
+        posts.append({
+            "client": "Bench",
+            "post_type": "Feed",
+            "caption": f"Publicação de benchmark {i}",
+            "image_url": "https://example.com/image.jpg",
+            "scheduled_at": scheduled_at,
+            "account_id": account_id,
+            "user_id": user_id
+        })
+    return database.insert_posts(posts)
+
+def count_status(database, post_ids, status):
+    with database.connection() as conn:
+        placeholders = ",".join("?" for _ in post_ids)
+        return conn.execute(
+            f"SELECT COUNT(*) FROM posts WHERE status = ? AND id IN ({placeholders})",
+            [status] + list(post_ids)
+        ).fetchone()[0]
+
+def wait_until_settled(database, post_ids, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        pending = count_status(database, post_ids, "Agendado") + count_status(database, post_ids, "Publicando")
+        if pending == 0:
+            return True
+        time.sleep(0.05)
+    return False
+
+def bench_publish(database, accounts, count, timeout, rng):
+    import workers
+    scheduled_at = (datetime.now() - timedelta(seconds=1)).isoformat(timespec="seconds")
+    post_ids = insert_due_posts(database, accounts, count, scheduled_at, rng)
+    claimed = []
+    while len(claimed) < count:
+        batch = database.claim_due_posts(datetime.now().isoformat(timespec="seconds"), 1000)
+        if not batch:
+            break
+        claimed += batch
+    started = time.perf_counter()
+    for post_id in claimed:
+        workers.submit(post_id)
+    settled = wait_until_settled(database, post_ids, timeout)
+    elapsed = time.perf_counter() - started
+    return {
+        "posts": count,
+        "workers": workers.PUBLISH_WORKERS,
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 1),
+        "published": count_status(database, post_ids, "Publicado"),
+        "retrying": count_status(database, post_ids, "Nova tentativa"),
+        "failed": count_status(database, post_ids, "Falhou"),
+        "settled": settled
+    }
+
+def bench_schedule_lag(database, accounts, count, timeout, rng):
+    try:
+        import scheduler
+    except ImportError as exc:
+        return {"skipped": f"APScheduler indisponível: {exc}"}
+    import publisher
+    publisher.publish_lags.clear()
+    scheduled = datetime.now().replace(microsecond=0) + timedelta(seconds=2)
+    post_ids = insert_due_posts(database, accounts, count, scheduled.isoformat(timespec="seconds"), rng)
+    wanted = set(post_ids)
+    stop = threading.Event()
+
+    def dispatch_loop():
+        while not stop.is_set():
+            scheduler.dispatch_due_posts()
+            stop.wait(scheduler.DISPATCH_INTERVAL)
+
+    thread = threading.Thread(target=dispatch_loop, daemon=True)
+    thread.start()
+    settled = wait_until_settled(database, post_ids, timeout + 2)
+    stop.set()
+    thread.join()
+    lags = [lag for post_id, lag, _ in list(publisher.publish_lags) if post_id in wanted]
+    result = {key.replace("_ms", "_lag_ms"): value for key, value in percentiles(lags).items()}
+    result.update({"posts": count, "dispatch_interval": scheduler.DISPATCH_INTERVAL, "settled": settled})
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(current, baseline, threshold):
+    regressions = []
+    base = flatten(baseline.get("results", {}))
+    for name, value in flatten(current["results"]).items():
+        previous = base.get(name)
+        if not previous:
+            continue
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf.endswith(HIGHER_IS_BETTER):
+            change = (previous - value) / previous
+        elif leaf.endswith(LOWER_IS_BETTER):
+            change = (value - previous) / previous
+        else:
+            continue
+        if change > threshold:
+            regressions.append({"metric": name, "baseline": previous, "current": value, "change": round(change, 3)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reproduzível do instaSchedule")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="small=10k, medium=100k, large=1M posts")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--accounts-per-user", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--publish-posts", type=int, default=500)
+    parser.add_argument("--lag-posts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="latência do stub Graph em segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--db", help="reaproveita um banco já populado por bench/seed.py")
+    parser.add_argument("--output", help="grava o resultado JSON neste arquivo")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="variação tolerada antes de acusar regressão")
+    args = parser.parse_args()
+    posts = PRESETS[args.preset] if args.preset else args.posts
+    rng = random.Random(1234)
+
+    stub = start_stub(latency=args.latency, error_rate=args.error_rate)
+    os.environ["GRAPH_API_BASE"] = stub.base_url
+    os.environ.setdefault("PRESTAGE_MINUTES", "0")
+    os.environ.setdefault("DISPATCH_INTERVAL", "1")
+    os.environ.setdefault("ACCOUNT_RATE_PER_MINUTE", "6000")
+    os.environ.setdefault("ACCOUNT_BURST", "100")
+
+    import database
+    seeded_at = time.perf_counter()
+    if args.db:
+        database.DB = args.db
+        database.create_tables()
+        with database.connection() as conn:
+            user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+            accounts = [tuple(row) for row in conn.execute("SELECT user_id, id FROM accounts")]
+        seed_seconds = None
+    else:
+        from seed import seed
+        database.DB = os.path.join(tempfile.mkdtemp(prefix="instaschedule-bench-"), "bench.db")
+        database.create_tables()
+        user_ids, accounts = seed(posts, args.users, args.accounts_per_user)
+        seed_seconds = round(time.perf_counter() - seeded_at, 3)
+
+    results = {
+        "queries": bench_queries(database, user_ids, args.iterations, rng),
+        "dashboard": bench_dashboard(user_ids, max(1, args.iterations // 4), rng),
+        "publish": bench_publish(database, accounts, args.publish_posts, args.timeout, rng),
+        "schedule": bench_schedule_lag(database, accounts, args.lag_posts, args.timeout, rng)
+    }
+    stub.shutdown()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {
+            "posts": posts,
+            "users": args.users,
+            "accounts_per_user": args.accounts_per_user,
+            "iterations": args.iterations,
+            "stub_latency": args.latency,
+            "stub_error_rate": args.error_rate,
+            "seed_seconds": seed_seconds,
+            "db": database.DB
+        },
+        "stub_calls": stub.calls,
+        "results": results
+    }
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            report["regressions"] = compare(report, json.load(baseline_file), args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
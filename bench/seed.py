@@ -0,0 +1,78 @@
+import os
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+STATUSES = (("Publicado", 0.6), ("Agendado", 0.35), ("Falhou", 0.05))
+POST_TYPES = ("Feed", "Story", "Reels")
+WORDS = (
+    "promoção", "lançamento", "verão", "coleção", "desconto", "novidade", "bastidores", "evento",
+    "sorteio", "parceria", "receita", "tutorial", "cliente", "depoimento", "entrega", "frete",
+    "café", "praia", "moda", "beleza", "saúde", "treino", "viagem", "pet"
+)
+CHUNK_SIZE = 50000
+
+def seed(posts, users, accounts_per_user, seed_value=42):
+    rng = random.Random(seed_value)
+    now = datetime.now()
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        user_ids = []
+        for i in range(users):
+            c.execute(
+                "INSERT INTO users (name, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                (f"Agência {i}", f"bench{i}@example.com", "x", now.isoformat())
+            )
+            user_ids.append(c.lastrowid)
+        accounts = []
+        for user_id in user_ids:
+            for j in range(accounts_per_user):
+                c.execute("""
+                    INSERT INTO accounts (user_id, client_name, ig_user_id, access_token, token_expires_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, f"Cliente {user_id}-{j}", f"ig{user_id}_{j}", f"token{user_id}_{j}", None, now.isoformat()))
+                accounts.append((user_id, c.lastrowid))
+
+        statuses = [status for status, _ in STATUSES]
+        weights = [weight for _, weight in STATUSES]
+        for start in range(0, posts, CHUNK_SIZE):
+            rows = []
+            for i in range(start, min(start + CHUNK_SIZE, posts)):
+                user_id, account_id = accounts[rng.randrange(len(accounts))]
+                status = rng.choices(statuses, weights)[0]
+                offset = rng.randint(-365 * 24 * 60, -1) if status != "Agendado" else rng.randint(60, 90 * 24 * 60)
+                rows.append((
+                    f"Cliente {account_id}",
+                    rng.choice(POST_TYPES),
+                    f"Legenda do post {i} {' '.join(rng.sample(WORDS, 4))} #campanha{i % 50} #{rng.choice(WORDS)}",
+                    "https://example.com/image.jpg",
+                    (now + timedelta(minutes=offset)).isoformat(timespec="seconds"),
+                    status,
+                    account_id,
+                    user_id
+                ))
+            c.executemany("""
+                INSERT INTO posts (client, post_type, caption, image_url, scheduled_at, status, account_id, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        conn.commit()
+        c.execute("ANALYZE")
+    return user_ids, accounts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Popula um banco de benchmark do instaSchedule")
+    parser.add_argument("--db", required=True, help="caminho do arquivo SQLite a criar")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--accounts-per-user", type=int, default=5)
+    args = parser.parse_args()
+    database.DB = args.db
+    database.create_tables()
+    seed(args.posts, args.users, args.accounts_per_user)
+    print(f"{args.posts} posts em {args.db}")
@@ -0,0 +1,74 @@
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class StubGraphServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.05, error_rate=0.0):
+        super().__init__(address, StubGraphHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ids = itertools.count(1)
+        self.calls = {"media": 0, "media_publish": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v19.0"
+
+class StubGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if endpoint not in ("media", "media_publish"):
+            self._send(404, {"error": {"message": "Unknown path", "code": 803}})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.calls[endpoint] += 1
+            failed = random.random() < server.error_rate
+            if failed:
+                server.calls["errors"] += 1
+            object_id = next(server.ids)
+        if failed:
+            self._send(500, {"error": {"message": "An unexpected error has occurred", "code": 2}})
+            return
+        self._send(200, {"id": str(object_id)})
+
+def start_stub(latency=0.05, error_rate=0.0, host="127.0.0.1", port=0):
+    server = StubGraphServer((host, port), latency=latency, error_rate=error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita /media e /media_publish da Graph API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="latência por chamada em segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubGraphServer((args.host, args.port), latency=args.latency, error_rate=args.error_rate)
+    print(f"Stub Graph API em {server.base_url}")
+    server.serve_forever()
@@ -1,18 +1,104 @@
+import os
+import time
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from metrics import db_timed
 
-DB = "posts.db"
+DB = os.environ.get("DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "posts.db"))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "10"))
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "60"))
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "1024"))
+CALENDAR_CACHE_TTL = float(os.environ.get("CALENDAR_CACHE_TTL", "30"))
+
+_idle = queue.LifoQueue()
+
+class LRUCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+user_cache = LRUCache()
+calendar_cache = LRUCache(ttl=CALENDAR_CACHE_TTL)
 
 def connect():
-    return sqlite3.connect(DB, check_same_thread=False)
+    conn = sqlite3.connect(
+        DB,
+        check_same_thread=False,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_STATEMENT_CACHE
+    )
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+@contextmanager
+def connection():
+    path, conn = DB, None
+    while conn is None:
+        try:
+            idle_path, idle_conn = _idle.get_nowait()
+        except queue.Empty:
+            conn = connect()
+            break
+        if idle_path == DB:
+            conn = idle_conn
+        else:
+            idle_conn.close()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if _idle.qsize() < DB_POOL_SIZE:
+            _idle.put((path, conn))
+        else:
+            conn.close()
+
+def close_connections():
+    while True:
+        try:
+            _, conn = _idle.get_nowait()
+        except queue.Empty:
+            return
+        conn.close()
 
 def _column_exists(cursor, table, column):
     cursor.execute(f"PRAGMA table_info({table})")
     return any(row[1] == column for row in cursor.fetchall())
 
-def create_tables():
-    conn = connect()
-    c = conn.cursor()
+def _migration_1(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS posts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,6 +114,24 @@ def create_tables():
         c.execute("ALTER TABLE posts ADD COLUMN account_id INTEGER")
     if not _column_exists(c, "posts", "user_id"):
         c.execute("ALTER TABLE posts ADD COLUMN user_id INTEGER")
+    if not _column_exists(c, "posts", "claimed_at"):
+        c.execute("ALTER TABLE posts ADD COLUMN claimed_at TEXT")
+    if not _column_exists(c, "posts", "creation_id"):
+        c.execute("ALTER TABLE posts ADD COLUMN creation_id TEXT")
+    if not _column_exists(c, "posts", "staged_at"):
+        c.execute("ALTER TABLE posts ADD COLUMN staged_at TEXT")
+    if not _column_exists(c, "posts", "publish_url"):
+        c.execute("ALTER TABLE posts ADD COLUMN publish_url TEXT")
+    if not _column_exists(c, "posts", "thumb_url"):
+        c.execute("ALTER TABLE posts ADD COLUMN thumb_url TEXT")
+    if not _column_exists(c, "posts", "attempts"):
+        c.execute("ALTER TABLE posts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if not _column_exists(c, "posts", "next_attempt_at"):
+        c.execute("ALTER TABLE posts ADD COLUMN next_attempt_at TEXT")
+    if not _column_exists(c, "posts", "last_error"):
+        c.execute("ALTER TABLE posts ADD COLUMN last_error TEXT")
+    if not _column_exists(c, "posts", "claimed_by"):
+        c.execute("ALTER TABLE posts ADD COLUMN claimed_by TEXT")
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,160 +155,1005 @@ def create_tables():
     """)
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_scheduled_at ON posts (scheduled_at)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_status ON posts (status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_status_scheduled_at ON posts (status, scheduled_at)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_scheduled_at ON posts (user_id, scheduled_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_status_scheduled_at ON posts (user_id, status, scheduled_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_retry ON posts (next_attempt_at) WHERE status = 'Nova tentativa'")
     c.execute("CREATE INDEX IF NOT EXISTS idx_accounts_user_id ON accounts (user_id)")
-    conn.commit()
-    conn.close()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_counters'")
+    counters_exist = c.fetchone() is not None
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_counters (
+            user_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, account_id, status)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_counters_insert AFTER INSERT ON posts
+        BEGIN
+            INSERT INTO post_counters (user_id, account_id, status, count)
+            VALUES (COALESCE(NEW.user_id, 0), COALESCE(NEW.account_id, 0), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (user_id, account_id, status) DO UPDATE SET count = count + 1;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_counters_delete AFTER DELETE ON posts
+        BEGIN
+            UPDATE post_counters SET count = count - 1
+            WHERE user_id = COALESCE(OLD.user_id, 0)
+              AND account_id = COALESCE(OLD.account_id, 0)
+              AND status = COALESCE(OLD.status, '');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_counters_update AFTER UPDATE OF user_id, account_id, status ON posts
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.account_id IS NOT NEW.account_id OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE post_counters SET count = count - 1
+            WHERE user_id = COALESCE(OLD.user_id, 0)
+              AND account_id = COALESCE(OLD.account_id, 0)
+              AND status = COALESCE(OLD.status, '');
+            INSERT INTO post_counters (user_id, account_id, status, count)
+            VALUES (COALESCE(NEW.user_id, 0), COALESCE(NEW.account_id, 0), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (user_id, account_id, status) DO UPDATE SET count = count + 1;
+        END
+    """)
+    if not counters_exist:
+        _rebuild_counters(c, _COUNTERS_FROM_POSTS)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS uploads (
+            sha256 TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            url TEXT NOT NULL UNIQUE,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            uploaded_at TEXT
+        )
+    """)
+    if not _column_exists(c, "uploads", "publish_url"):
+        c.execute("ALTER TABLE uploads ADD COLUMN publish_url TEXT")
+    if not _column_exists(c, "uploads", "thumb_url"):
+        c.execute("ALTER TABLE uploads ADD COLUMN thumb_url TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_image_url ON posts (image_url)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploads_refcount ON uploads (refcount, uploaded_at)")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_uploads_insert AFTER INSERT ON posts
+        WHEN NEW.image_url IS NOT NULL
+        BEGIN
+            UPDATE uploads SET refcount = refcount + 1 WHERE url = NEW.image_url;
+            UPDATE posts SET
+                publish_url = (SELECT publish_url FROM uploads WHERE url = NEW.image_url),
+                thumb_url = (SELECT thumb_url FROM uploads WHERE url = NEW.image_url)
+            WHERE id = NEW.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_uploads_delete AFTER DELETE ON posts
+        WHEN OLD.image_url IS NOT NULL
+        BEGIN
+            UPDATE uploads SET refcount = refcount - 1 WHERE url = OLD.image_url;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_uploads_update AFTER UPDATE OF image_url ON posts
+        WHEN OLD.image_url IS NOT NEW.image_url
+        BEGIN
+            UPDATE uploads SET refcount = refcount - 1 WHERE url = OLD.image_url;
+            UPDATE uploads SET refcount = refcount + 1 WHERE url = NEW.image_url;
+            UPDATE posts SET
+                publish_url = (SELECT publish_url FROM uploads WHERE url = NEW.image_url),
+                thumb_url = (SELECT thumb_url FROM uploads WHERE url = NEW.image_url)
+            WHERE id = NEW.id;
+        END
+    """)
 
-def insert_post(data):
-    conn = connect()
-    c = conn.cursor()
+POST_COLUMNS = (
+    "id, client, post_type, caption, image_url, scheduled_at, status, account_id, user_id, claimed_at, "
+    "creation_id, staged_at, publish_url, thumb_url, attempts, next_attempt_at, last_error, claimed_by"
+)
+
+def _migration_2(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS posts_archive (
+            id INTEGER PRIMARY KEY,
+            client TEXT,
+            post_type TEXT,
+            caption TEXT,
+            image_url TEXT,
+            scheduled_at TEXT,
+            status TEXT,
+            account_id INTEGER,
+            user_id INTEGER,
+            claimed_at TEXT,
+            creation_id TEXT,
+            staged_at TEXT,
+            publish_url TEXT,
+            thumb_url TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            claimed_by TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_archive_user_scheduled_at ON posts_archive (user_id, scheduled_at, id)")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_archive_insert AFTER INSERT ON posts_archive
+        BEGIN
+            INSERT INTO post_counters (user_id, account_id, status, count)
+            VALUES (COALESCE(NEW.user_id, 0), COALESCE(NEW.account_id, 0), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (user_id, account_id, status) DO UPDATE SET count = count + 1;
+            UPDATE uploads SET refcount = refcount + 1 WHERE url = NEW.image_url;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_archive_delete AFTER DELETE ON posts_archive
+        BEGIN
+            UPDATE post_counters SET count = count - 1
+            WHERE user_id = COALESCE(OLD.user_id, 0)
+              AND account_id = COALESCE(OLD.account_id, 0)
+              AND status = COALESCE(OLD.status, '');
+            UPDATE uploads SET refcount = refcount - 1 WHERE url = OLD.image_url;
+        END
+    """)
+
+def _migration_3(c):
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            caption, client, owner,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_fts_insert AFTER INSERT ON posts
+        BEGIN
+            INSERT INTO posts_fts (rowid, caption, client, owner)
+            VALUES (NEW.id, NEW.caption, NEW.client, 'u' || NEW.user_id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_fts_update AFTER UPDATE OF caption, client, user_id ON posts
+        BEGIN
+            UPDATE posts_fts SET caption = NEW.caption, client = NEW.client, owner = 'u' || NEW.user_id
+            WHERE rowid = NEW.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_fts_delete AFTER DELETE ON posts
+        WHEN NOT EXISTS (SELECT 1 FROM posts_archive WHERE id = OLD.id)
+        BEGIN
+            DELETE FROM posts_fts WHERE rowid = OLD.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_archive_fts_insert AFTER INSERT ON posts_archive
+        WHEN NOT EXISTS (SELECT 1 FROM posts_fts WHERE rowid = NEW.id)
+        BEGIN
+            INSERT INTO posts_fts (rowid, caption, client, owner)
+            VALUES (NEW.id, NEW.caption, NEW.client, 'u' || NEW.user_id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_archive_fts_delete AFTER DELETE ON posts_archive
+        BEGIN
+            DELETE FROM posts_fts WHERE rowid = OLD.id;
+        END
+    """)
+    c.execute("DELETE FROM posts_fts")
+    c.execute("""
+        INSERT INTO posts_fts (rowid, caption, client, owner)
+        SELECT id, caption, client, 'u' || user_id FROM posts
+        UNION ALL
+        SELECT id, caption, client, 'u' || user_id FROM posts_archive
+    """)
+
+def _migration_4(c):
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_posts_user_calendar
+        ON posts (user_id, scheduled_at, account_id, status)
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_posts_archive_user_calendar
+        ON posts_archive (user_id, scheduled_at, account_id, status)
+    """)
+
+def _migration_5(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            post_id INTEGER,
+            type TEXT NOT NULL,
+            status TEXT,
+            previous TEXT,
+            created_at INTEGER NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_events_user_id ON post_events (user_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_events_created_at ON post_events (created_at)")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_posts_events_status AFTER UPDATE OF status ON posts
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO post_events (user_id, post_id, type, status, previous, created_at)
+            VALUES (NEW.user_id, NEW.id, 'status', NEW.status, OLD.status, CAST(strftime('%s', 'now') AS INTEGER));
+        END
+    """)
+
+_CANONICAL_DATETIME = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+
+def _migration_6(c):
+    for table in ("posts", "posts_archive"):
+        c.execute(f"SELECT id, scheduled_at FROM {table} WHERE scheduled_at NOT GLOB ?", (_CANONICAL_DATETIME,))
+        for post_id, scheduled_at in c.fetchall():
+            try:
+                value = normalize_datetime(scheduled_at)
+            except (TypeError, ValueError):
+                continue
+            c.execute(f"UPDATE {table} SET scheduled_at = ? WHERE id = ?", (value, post_id))
+
+def _migration_7(c):
+    c.execute("ALTER TABLE accounts ADD COLUMN token_invalid_at TEXT")
+
+def _migration_8(c):
     c.execute("""
-        INSERT INTO posts (client, post_type, caption, image_url, scheduled_at, status, account_id, user_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+        CREATE TABLE IF NOT EXISTS post_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id INTEGER NOT NULL,
+            attempted_at TEXT NOT NULL,
+            decision TEXT NOT NULL,
+            error TEXT,
+            retry_after REAL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_attempts_post_id ON post_attempts (post_id, id)")
+
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6, _migration_7, _migration_8]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+@db_timed
+def create_tables():
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("PRAGMA user_version")
+        version = c.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("PRAGMA user_version")
+        version = c.fetchone()[0]
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[number - 1](c)
+            c.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+_COUNTERS_FROM_POSTS = """
+    SELECT COALESCE(user_id, 0), COALESCE(account_id, 0), COALESCE(status, ''), COUNT(*)
+    FROM posts
+    GROUP BY 1, 2, 3
+"""
+
+_COUNTERS_FROM_ALL_POSTS = """
+    SELECT COALESCE(user_id, 0), COALESCE(account_id, 0), COALESCE(status, ''), COUNT(*)
+    FROM (
+        SELECT user_id, account_id, status FROM posts
+        UNION ALL
+        SELECT user_id, account_id, status FROM posts_archive
+    )
+    GROUP BY 1, 2, 3
+"""
+
+def _rebuild_counters(cursor, source=_COUNTERS_FROM_ALL_POSTS):
+    cursor.execute("DELETE FROM post_counters")
+    cursor.execute(f"INSERT INTO post_counters (user_id, account_id, status, count) {source}")
+
+@db_timed
+def rebuild_counters():
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        _rebuild_counters(c)
+        conn.commit()
+
+@db_timed
+def verify_counters():
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(_COUNTERS_FROM_ALL_POSTS)
+        expected = {row[:3]: row[3] for row in c.fetchall()}
+        c.execute("SELECT user_id, account_id, status, count FROM post_counters WHERE count != 0")
+        actual = {row[:3]: row[3] for row in c.fetchall()}
+    drift = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            drift.append(key + (expected.get(key, 0), actual.get(key, 0)))
+    return drift
+
+_INSERT_POST = """
+    INSERT INTO posts (client, post_type, caption, image_url, scheduled_at, status, account_id, user_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def normalize_datetime(value):
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat(timespec="seconds")
+
+def _post_values(data):
+    return (
         data["client"],
         data["post_type"],
         data["caption"],
         data["image_url"],
-        data["scheduled_at"],
+        normalize_datetime(data["scheduled_at"]),
         "Agendado",
         data.get("account_id"),
         data.get("user_id")
-    ))
-    conn.commit()
-    post_id = c.lastrowid
-    conn.close()
-    return post_id
+    )
+
+@db_timed
+def insert_post(data):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(_INSERT_POST, _post_values(data))
+        post_id = c.lastrowid
+        _record_post_event(c, data["user_id"], post_id, "created")
+        conn.commit()
+        return post_id
 
+@db_timed
+def insert_posts(posts):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'posts'")
+        row = c.fetchone()
+        first_id = (row[0] if row else 0) + 1
+        c.executemany(_INSERT_POST, [_post_values(data) for data in posts])
+        for user_id in {data["user_id"] for data in posts}:
+            _record_post_event(c, user_id, None, "created")
+        conn.commit()
+    return list(range(first_id, first_id + len(posts)))
+
+@db_timed
 def get_posts(user_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT * FROM posts WHERE user_id = ? ORDER BY scheduled_at ASC", (user_id,))
-    posts = c.fetchall()
-    conn.close()
-    return posts
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT * FROM posts WHERE user_id = ?
+            UNION ALL
+            SELECT * FROM posts_archive WHERE user_id = ?
+            ORDER BY scheduled_at ASC
+        """, (user_id, user_id))
+        posts = c.fetchall()
+        return posts
+
+@db_timed
+def get_posts_page(user_id, after=None, limit=50, status=None, account_id=None, date_from=None, date_to=None):
+    clauses = ["user_id = ?"]
+    params = [user_id]
+    if after:
+        clauses.append("(scheduled_at, id) > (?, ?)")
+        params += [after[0], after[1]]
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+    if account_id:
+        clauses.append("account_id = ?")
+        params.append(account_id)
+    if date_from:
+        clauses.append("scheduled_at >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("scheduled_at <= ?")
+        params.append(date_to)
+    where = " AND ".join(clauses)
+    query = f"SELECT * FROM posts WHERE {where}"
+    if status in (None, "", "Publicado"):
+        query += f" UNION ALL SELECT * FROM posts_archive WHERE {where}"
+        params += params
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(f"{query} ORDER BY scheduled_at ASC, id ASC LIMIT ?", params + [limit])
+        return c.fetchall()
+
+CALENDAR_BUCKETS = {"day": 10, "hour": 13}
 
+@db_timed
+def get_calendar(user_id, date_from, date_to, bucket="day", account_id=None):
+    where = "user_id = ? AND scheduled_at >= ? AND scheduled_at < ?"
+    params = [user_id, date_from, date_to]
+    if account_id:
+        where += " AND account_id = ?"
+        params.append(account_id)
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM post_events WHERE user_id = ?", (user_id,))
+        key = (user_id, c.fetchone()[0], date_from, date_to, bucket, account_id)
+        rows = calendar_cache.get(key)
+        if rows is not None:
+            return rows
+        c.execute(f"""
+            SELECT substr(scheduled_at, 1, ?), account_id, status, COUNT(*)
+            FROM (
+                SELECT scheduled_at, account_id, status FROM posts WHERE {where}
+                UNION ALL
+                SELECT scheduled_at, account_id, status FROM posts_archive WHERE {where}
+            )
+            GROUP BY 1, 2, 3
+            ORDER BY 1
+        """, [CALENDAR_BUCKETS[bucket]] + params + params)
+        rows = tuple(c.fetchall())
+        calendar_cache.set(key, rows)
+        return rows
+
+@db_timed
 def get_post(user_id, post_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT * FROM posts WHERE id = ? AND user_id = ?", (post_id, user_id))
-    post = c.fetchone()
-    conn.close()
-    return post
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM posts WHERE id = ? AND user_id = ?", (post_id, user_id))
+        post = c.fetchone()
+        if post is None:
+            c.execute("SELECT * FROM posts_archive WHERE id = ? AND user_id = ?", (post_id, user_id))
+            post = c.fetchone()
+        return post
+
+def _search_expression(text):
+    terms = []
+    for word in text.split():
+        word = word.lstrip("#").replace('"', "")
+        if word:
+            terms.append(f'"{word}"*')
+    return " AND ".join(terms)
 
+@db_timed
+def search_posts(user_id, text, limit=20):
+    expression = _search_expression(text)
+    if not expression:
+        return []
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT rowid FROM posts_fts
+            WHERE posts_fts MATCH ?
+            ORDER BY bm25(posts_fts, 1.0, 2.0, 0.0)
+            LIMIT ?
+        """, (f'owner : "u{int(user_id)}" AND {{caption client}} : ({expression})', limit))
+        post_ids = [row[0] for row in c.fetchall()]
+        if not post_ids:
+            return []
+        placeholders = ",".join("?" for _ in post_ids)
+        c.execute(f"""
+            SELECT * FROM posts WHERE id IN ({placeholders}) AND user_id = ?
+            UNION ALL
+            SELECT * FROM posts_archive WHERE id IN ({placeholders}) AND user_id = ?
+        """, post_ids + [user_id] + post_ids + [user_id])
+        by_id = {post[0]: post for post in c.fetchall()}
+        return [by_id[post_id] for post_id in post_ids if post_id in by_id]
+
+@db_timed
 def update_post(user_id, post_id, data):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("""
-        UPDATE posts
-        SET client = ?, post_type = ?, caption = ?, image_url = ?, scheduled_at = ?, account_id = ?
-        WHERE id = ? AND user_id = ?
-    """, (
-        data["client"],
-        data["post_type"],
-        data["caption"],
-        data["image_url"],
-        data["scheduled_at"],
-        data.get("account_id"),
-        post_id,
-        user_id
-    ))
-    conn.commit()
-    updated = c.rowcount
-    conn.close()
-    return updated
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE posts
+            SET client = ?, post_type = ?, caption = ?, image_url = ?, scheduled_at = ?, account_id = ?,
+                creation_id = NULL, staged_at = NULL,
+                attempts = CASE WHEN status IN ('Falhou', 'Nova tentativa') THEN 0 ELSE attempts END,
+                next_attempt_at = NULL,
+                status = CASE WHEN status IN ('Falhou', 'Nova tentativa') THEN 'Agendado' ELSE status END
+            WHERE id = ? AND user_id = ?
+        """, (
+            data["client"],
+            data["post_type"],
+            data["caption"],
+            data["image_url"],
+            normalize_datetime(data["scheduled_at"]),
+            data.get("account_id"),
+            post_id,
+            user_id
+        ))
+        updated = c.rowcount
+        if updated:
+            _record_post_event(c, user_id, post_id, "updated")
+        conn.commit()
+        return updated
 
+@db_timed
 def delete_post(user_id, post_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM posts WHERE id = ? AND user_id = ?", (post_id, user_id))
-    conn.commit()
-    deleted = c.rowcount
-    conn.close()
-    return deleted
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM posts WHERE id = ? AND user_id = ?", (post_id, user_id))
+        deleted = c.rowcount
+        if deleted == 0:
+            c.execute("DELETE FROM posts_archive WHERE id = ? AND user_id = ?", (post_id, user_id))
+            deleted = c.rowcount
+        if deleted:
+            c.execute("DELETE FROM post_attempts WHERE post_id = ?", (post_id,))
+            _record_post_event(c, user_id, post_id, "deleted")
+        conn.commit()
+        return deleted
 
-def get_counts(user_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM posts WHERE user_id = ?", (user_id,))
-    total = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM posts WHERE status = ? AND user_id = ?", ("Publicado", user_id))
-    published = c.fetchone()[0]
-    conn.close()
-    return {"total": total, "published": published}
+@db_timed
+def archive_published_posts(before, limit):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT id FROM posts
+            WHERE status = ? AND scheduled_at < ?
+            ORDER BY scheduled_at ASC
+            LIMIT ?
+        """, ("Publicado", before, limit))
+        post_ids = [row[0] for row in c.fetchall()]
+        if post_ids:
+            placeholders = ",".join("?" for _ in post_ids)
+            c.execute(
+                f"INSERT INTO posts_archive ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM posts WHERE id IN ({placeholders})",
+                post_ids
+            )
+            c.execute(f"DELETE FROM posts WHERE id IN ({placeholders})", post_ids)
+        conn.commit()
+        return len(post_ids)
 
-def create_user(name, email, password_hash):
-    conn = connect()
-    c = conn.cursor()
+@db_timed
+def has_posts_due(before):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT EXISTS (SELECT 1 FROM posts WHERE status = 'Agendado' AND scheduled_at <= ?)
+                OR EXISTS (SELECT 1 FROM posts WHERE status = 'Nova tentativa' AND next_attempt_at <= ?)
+                OR EXISTS (SELECT 1 FROM posts WHERE status = 'Publicando')
+        """, (before, before))
+        return bool(c.fetchone()[0])
+
+@db_timed
+def compact_database(pages=None, full=False):
+    with connection() as conn:
+        if full:
+            conn.execute("VACUUM")
+        elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)})")
+        conn.execute("PRAGMA optimize")
+
+def _record_post_event(c, user_id, post_id, event_type):
     c.execute("""
-        INSERT INTO users (name, email, password_hash, created_at)
+        INSERT INTO post_events (user_id, post_id, type, created_at)
         VALUES (?, ?, ?, ?)
-    """, (name, email, password_hash, datetime.utcnow().isoformat()))
-    conn.commit()
-    user_id = c.lastrowid
-    conn.close()
-    return user_id
+    """, (user_id, post_id, event_type, int(time.time())))
+
+@db_timed
+def get_post_events(after_id, limit, user_id=None):
+    with connection() as conn:
+        c = conn.cursor()
+        if user_id is None:
+            c.execute("""
+                SELECT id, user_id, post_id, type, status, previous FROM post_events
+                WHERE id > ? ORDER BY id ASC LIMIT ?
+            """, (after_id, limit))
+        else:
+            c.execute("""
+                SELECT id, user_id, post_id, type, status, previous FROM post_events
+                WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?
+            """, (user_id, after_id, limit))
+        return c.fetchall()
+
+@db_timed
+def get_last_post_event_id(user_id=None):
+    with connection() as conn:
+        c = conn.cursor()
+        if user_id is None:
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM post_events")
+        else:
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM post_events WHERE user_id = ?", (user_id,))
+        return c.fetchone()[0]
 
+@db_timed
+def prune_post_events(before):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM post_events WHERE created_at < ?", (before,))
+        conn.commit()
+        deleted = c.rowcount
+        return deleted
+
+@db_timed
+def acquire_lease(name, owner, ttl):
+    now = time.time()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < ?
+        """, (name, owner, now + ttl, now))
+        conn.commit()
+        acquired = c.rowcount
+        return acquired > 0
+
+@db_timed
+def release_lease(name, owner):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
+        conn.commit()
+
+@db_timed
+def claim_post(post_id, now, owner=None):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE posts SET status = ?, claimed_at = ?, claimed_by = ?
+            WHERE id = ? AND status = ? AND scheduled_at <= ?
+        """, ("Publicando", now, owner, post_id, "Agendado", now))
+        conn.commit()
+        claimed = c.rowcount
+        return claimed > 0
+
+@db_timed
+def claim_due_posts(now, limit, owner=None):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT id FROM posts
+            WHERE status = ? AND scheduled_at <= ?
+            ORDER BY scheduled_at ASC
+            LIMIT ?
+        """, ("Agendado", now, limit))
+        post_ids = [row[0] for row in c.fetchall()]
+        c.executemany(
+            "UPDATE posts SET status = ?, claimed_at = ?, claimed_by = ? WHERE id = ?",
+            [("Publicando", now, owner, post_id) for post_id in post_ids]
+        )
+        conn.commit()
+        return post_ids
+
+@db_timed
+def claim_retry_posts(now, limit, owner=None):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT id FROM posts
+            WHERE status = ? AND next_attempt_at <= ?
+            ORDER BY next_attempt_at ASC
+            LIMIT ?
+        """, ("Nova tentativa", now, limit))
+        post_ids = [row[0] for row in c.fetchall()]
+        c.executemany(
+            "UPDATE posts SET status = ?, claimed_at = ?, claimed_by = ? WHERE id = ?",
+            [("Publicando", now, owner, post_id) for post_id in post_ids]
+        )
+        conn.commit()
+        return post_ids
+
+@db_timed
+def recover_stale_claims(claimed_before, now, limit):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE posts SET status = ?, next_attempt_at = ?, attempts = attempts + 1,
+                last_error = ?, claimed_by = NULL
+            WHERE id IN (
+                SELECT id FROM posts WHERE status = ? AND COALESCE(claimed_at, '') < ? LIMIT ?
+            )
+        """, ("Nova tentativa", now, "Publicação interrompida", "Publicando", claimed_before, limit))
+        conn.commit()
+        recovered = c.rowcount
+        return recovered
+
+@db_timed
+def get_posts_to_stage(now, until, expired_before, limit):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT id, caption, COALESCE(publish_url, image_url), account_id FROM posts
+            WHERE status = ? AND scheduled_at > ? AND scheduled_at <= ?
+              AND account_id IS NOT NULL AND image_url IS NOT NULL
+              AND (creation_id IS NULL OR staged_at < ?)
+            ORDER BY scheduled_at ASC
+            LIMIT ?
+        """, ("Agendado", now, until, expired_before, limit))
+        posts = c.fetchall()
+        return posts
+
+@db_timed
+def set_post_container(post_id, creation_id, staged_at, caption, image_url, account_id):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE posts SET creation_id = ?, staged_at = ?
+            WHERE id = ? AND status = ? AND caption IS ? AND COALESCE(publish_url, image_url) IS ? AND account_id IS ?
+        """, (creation_id, staged_at, post_id, "Agendado", caption, image_url, account_id))
+        conn.commit()
+        updated = c.rowcount
+        return updated
+
+@db_timed
+def get_posts_for_publish(post_ids):
+    with connection() as conn:
+        c = conn.cursor()
+        placeholders = ",".join("?" for _ in post_ids)
+        c.execute(f"""
+            SELECT posts.id, posts.caption, COALESCE(posts.publish_url, posts.image_url), posts.account_id, posts.scheduled_at,
+                   posts.creation_id, posts.staged_at, accounts.ig_user_id, accounts.access_token, posts.attempts,
+                   accounts.token_expires_at, posts.user_id, accounts.token_invalid_at
+            FROM posts
+            LEFT JOIN accounts ON accounts.id = posts.account_id
+            WHERE posts.id IN ({placeholders})
+        """, list(post_ids))
+        posts = c.fetchall()
+        return posts
+
+@db_timed
+def _record_attempts(c, attempts):
+    now = datetime.now().isoformat(timespec="seconds")
+    c.executemany("""
+        INSERT INTO post_attempts (post_id, attempted_at, decision, error, retry_after)
+        SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM posts WHERE id = ?)
+    """, [(post_id, now, decision, error, retry_after, post_id) for post_id, decision, error, retry_after in attempts])
+
+@db_timed
+def mark_posts_published(post_ids):
+    with connection() as conn:
+        c = conn.cursor()
+        c.executemany(
+            "UPDATE posts SET status = ?, next_attempt_at = NULL WHERE id = ?",
+            [("Publicado", post_id) for post_id in post_ids]
+        )
+        _record_attempts(c, [(post_id, "published", None, None) for post_id in post_ids])
+        conn.commit()
+
+@db_timed
+def mark_posts_failed(failures):
+    with connection() as conn:
+        c = conn.cursor()
+        c.executemany("""
+            UPDATE posts SET status = ?, attempts = attempts + 1, next_attempt_at = NULL, last_error = ?
+            WHERE id = ? AND status IN ('Agendado', 'Publicando')
+        """, [("Falhou", error, post_id) for post_id, error, _ in failures])
+        _record_attempts(c, [(post_id, decision, error, None) for post_id, error, decision in failures])
+        conn.commit()
+
+@db_timed
+def mark_posts_retry(retries):
+    with connection() as conn:
+        c = conn.cursor()
+        c.executemany("""
+            UPDATE posts SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?,
+                creation_id = NULL, staged_at = NULL
+            WHERE id = ? AND status IN ('Agendado', 'Publicando')
+        """, [("Nova tentativa", next_attempt_at, error, post_id) for post_id, next_attempt_at, error, _, _ in retries])
+        _record_attempts(c, [
+            (post_id, decision, error, retry_after) for post_id, _, error, decision, retry_after in retries
+        ])
+        conn.commit()
+
+@db_timed
+def get_post_attempts(post_id):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT attempted_at, decision, error, retry_after FROM post_attempts
+            WHERE post_id = ? ORDER BY id ASC
+        """, (post_id,))
+        return c.fetchall()
+
+@db_timed
+def get_post_for_publish(post_id):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT posts.id, posts.caption, COALESCE(posts.publish_url, posts.image_url), posts.account_id,
+                   posts.scheduled_at, posts.creation_id, posts.staged_at, posts.attempts, posts.user_id, accounts.*
+            FROM posts
+            LEFT JOIN accounts ON accounts.id = posts.account_id
+            WHERE posts.id = ?
+        """, (post_id,))
+        return c.fetchone()
+
+@db_timed
+def get_post_ig_user_id(post_id):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT accounts.ig_user_id FROM posts
+            JOIN accounts ON accounts.id = posts.account_id
+            WHERE posts.id = ?
+        """, (post_id,))
+        row = c.fetchone()
+        return row[0] if row else None
+
+@db_timed
+def get_counts(user_id):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT COALESCE(SUM(count), 0), COALESCE(SUM(CASE WHEN status = ? THEN count END), 0)
+            FROM post_counters WHERE user_id = ?
+        """, ("Publicado", user_id))
+        total, published = c.fetchone()
+        return {"total": total, "published": published}
+
+@db_timed
+def register_upload(sha256, filename, url, size):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO uploads (sha256, filename, url, size, uploaded_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sha256) DO UPDATE SET uploaded_at = excluded.uploaded_at
+        """, (sha256, filename, url, size, datetime.utcnow().isoformat()))
+        conn.commit()
+        c.execute("SELECT filename, url FROM uploads WHERE sha256 = ?", (sha256,))
+        return c.fetchone()
+
+@db_timed
+def set_upload_renditions(sha256, publish_url, thumb_url):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "UPDATE uploads SET publish_url = ?, thumb_url = ? WHERE sha256 = ?",
+            (publish_url, thumb_url, sha256)
+        )
+        c.execute("""
+            UPDATE posts SET publish_url = ?, thumb_url = ?
+            WHERE image_url = (SELECT url FROM uploads WHERE sha256 = ?)
+        """, (publish_url, thumb_url, sha256))
+        conn.commit()
+
+@db_timed
+def get_orphan_uploads(uploaded_before, limit):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT sha256, filename FROM uploads
+            WHERE refcount <= 0 AND uploaded_at < ?
+            LIMIT ?
+        """, (uploaded_before, limit))
+        return c.fetchall()
+
+@db_timed
+def delete_upload(sha256, uploaded_before, remove_files):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(
+            "DELETE FROM uploads WHERE sha256 = ? AND refcount <= 0 AND uploaded_at < ?",
+            (sha256, uploaded_before)
+        )
+        deleted = c.rowcount
+        if deleted:
+            remove_files()
+        conn.commit()
+        return deleted
+
+@db_timed
+def create_user(name, email, password_hash):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO users (name, email, password_hash, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (name, email, password_hash, datetime.utcnow().isoformat()))
+        conn.commit()
+        user_id = c.lastrowid
+        return user_id
+
+@db_timed
 def get_user_by_email(email):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE email = ?", (email,))
-    user = c.fetchone()
-    conn.close()
-    return user
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE email = ?", (email,))
+        user = c.fetchone()
+        return user
 
+@db_timed
 def get_user_by_id(user_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = c.fetchone()
-    conn.close()
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        user = c.fetchone()
+    if user is not None:
+        user_cache.set(user_id, user)
     return user
 
+@db_timed
 def add_account(data):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO accounts (user_id, client_name, ig_user_id, access_token, token_expires_at, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
-        data["user_id"],
-        data["client_name"],
-        data["ig_user_id"],
-        data["access_token"],
-        data.get("token_expires_at"),
-        datetime.utcnow().isoformat()
-    ))
-    conn.commit()
-    account_id = c.lastrowid
-    conn.close()
-    return account_id
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO accounts (user_id, client_name, ig_user_id, access_token, token_expires_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            data["user_id"],
+            data["client_name"],
+            data["ig_user_id"],
+            data["access_token"],
+            data.get("token_expires_at"),
+            datetime.utcnow().isoformat()
+        ))
+        conn.commit()
+        account_id = c.lastrowid
+        return account_id
 
+@db_timed
 def get_accounts(user_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT * FROM accounts WHERE user_id = ? ORDER BY client_name ASC", (user_id,))
-    accounts = c.fetchall()
-    conn.close()
-    return accounts
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM accounts WHERE user_id = ? ORDER BY client_name ASC", (user_id,))
+        accounts = c.fetchall()
+        return accounts
 
+@db_timed
 def delete_account(user_id, account_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
-    conn.commit()
-    deleted = c.rowcount
-    conn.close()
-    return deleted
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+        conn.commit()
+        deleted = c.rowcount
+        return deleted
+
+@db_timed
+def get_accounts_expiring(now, before, limit):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT id, access_token, token_expires_at FROM accounts
+            WHERE access_token IS NOT NULL AND token_invalid_at IS NULL
+              AND CAST(token_expires_at AS REAL) > ?
+              AND CAST(token_expires_at AS REAL) <= ?
+            ORDER BY CAST(token_expires_at AS REAL) ASC
+            LIMIT ?
+        """, (now, before, limit))
+        accounts = c.fetchall()
+        return accounts
+
+@db_timed
+def update_account_token(account_id, access_token, token_expires_at):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "UPDATE accounts SET access_token = ?, token_expires_at = ?, token_invalid_at = NULL WHERE id = ?",
+            (access_token, token_expires_at, account_id)
+        )
+        conn.commit()
+        updated = c.rowcount
+        return updated
+
+@db_timed
+def mark_accounts_token_invalid(account_ids):
+    with connection() as conn:
+        c = conn.cursor()
+        c.executemany(
+            "UPDATE accounts SET token_invalid_at = ? WHERE id = ?",
+            [(datetime.now().isoformat(timespec="seconds"), account_id) for account_id in account_ids]
+        )
+        conn.commit()
 
+@db_timed
 def get_account_by_id(user_id, account_id):
-    conn = connect()
-    c = conn.cursor()
-    if user_id is None:
-        c.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
-    else:
-        c.execute("SELECT * FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
-    account = c.fetchone()
-    conn.close()
-    return account
+    with connection() as conn:
+        c = conn.cursor()
+        if user_id is None:
+            c.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
+        else:
+            c.execute("SELECT * FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+        account = c.fetchone()
+        return account
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import queue
+import threading
+from database import get_last_post_event_id, get_post_events
+from metrics import counter, gauge
+
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "1"))
+EVENTS_POLL_BATCH = int(os.environ.get("EVENTS_POLL_BATCH", "500"))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get("EVENTS_MAX_SUBSCRIBERS", "1000"))
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", "15"))
+EVENTS_MAX_CONNECTION_SECONDS = float(os.environ.get("EVENTS_MAX_CONNECTION_SECONDS", "300"))
+EVENTS_RETRY_MS = int(os.environ.get("EVENTS_RETRY_MS", "3000"))
+
+_subscribers = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_thread = None
+
+def _subscriber_count():
+    with _lock:
+        return sum(len(queues) for queues in _subscribers.values())
+
+events_dropped_total = counter("events_dropped_total", "Eventos descartados com a fila do assinante cheia")
+gauge("events_subscribers", "Conexões de eventos abertas", _subscriber_count)
+
+def _poller():
+    last_id = get_last_post_event_id()
+    while True:
+        _wake.wait(EVENTS_POLL_INTERVAL)
+        _wake.clear()
+        with _lock:
+            idle = not _subscribers
+        if idle:
+            last_id = get_last_post_event_id()
+            continue
+        while True:
+            try:
+                rows = get_post_events(last_id, EVENTS_POLL_BATCH)
+            except Exception as exc:
+                print(f"⚠️ Falha ao ler eventos de posts: {exc}")
+                break
+            for row in rows:
+                last_id = row[0]
+                _fanout(row)
+            if len(rows) < EVENTS_POLL_BATCH:
+                break
+
+def _fanout(row):
+    with _lock:
+        queues = list(_subscribers.get(row[1], ()))
+    for subscriber in queues:
+        try:
+            subscriber.put_nowait(row)
+        except queue.Full:
+            events_dropped_total.inc()
+
+def _ensure_poller():
+    global _thread
+    if _thread:
+        return
+    with _lock:
+        if _thread:
+            return
+        _thread = threading.Thread(target=_poller, name="events-poller", daemon=True)
+        _thread.start()
+
+def subscribe(user_id):
+    _ensure_poller()
+    with _lock:
+        if sum(len(queues) for queues in _subscribers.values()) >= EVENTS_MAX_SUBSCRIBERS:
+            return None
+        subscriber = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        _subscribers.setdefault(user_id, set()).add(subscriber)
+    return subscriber
+
+def unsubscribe(user_id, subscriber):
+    with _lock:
+        queues = _subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(subscriber)
+        if not queues:
+            del _subscribers[user_id]
+
+def wake():
+    _wake.set()
+
+def event_to_dict(row):
+    event_id, _, post_id, event_type, status, previous = row
+    return {"id": event_id, "type": event_type, "post_id": post_id, "status": status, "previous": previous}
+
+def format_event(row):
+    data = json.dumps(event_to_dict(row), ensure_ascii=False)
+    return f"id: {row[0]}\nevent: {row[3]}\ndata: {data}\n\n"
+
+def stream(user_id, subscriber, last_event_id=None):
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        sent = last_event_id or 0
+        if last_event_id is not None:
+            for row in get_post_events(last_event_id, EVENTS_QUEUE_SIZE, user_id):
+                sent = row[0]
+                yield format_event(row)
+        deadline = time.monotonic() + EVENTS_MAX_CONNECTION_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                row = subscriber.get(timeout=min(EVENTS_HEARTBEAT, remaining))
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if row[0] <= sent:
+                continue
+            sent = row[0]
+            yield format_event(row)
+    finally:
+        unsubscribe(user_id, subscriber)
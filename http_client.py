@@ -0,0 +1,116 @@
+import os
+import gzip
+import json
+import time
+import threading
+import http.client
+import urllib.parse
+from metrics import graph_request_seconds, graph_errors_total
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+_pools = {}
+_lock = threading.Lock()
+
+class HttpError(Exception):
+    def __init__(self, status, body, headers):
+        super().__init__(f"HTTP {status}: {body[:300]}")
+        self.status = status
+        self.body = body
+        self.headers = headers
+
+    @property
+    def graph_error(self):
+        try:
+            error = json.loads(self.body).get("error")
+        except (ValueError, AttributeError):
+            return {}
+        return error if isinstance(error, dict) else {}
+
+def observe_response(host, status, started):
+    graph_request_seconds.observe(time.perf_counter() - started, host, status)
+
+def response_error(status, data, headers):
+    error = HttpError(status, data.decode("utf-8", "replace"), headers)
+    graph_errors_total.inc(str(status), str(error.graph_error.get("code", "")))
+    return error
+
+def _acquire(key, timeout):
+    with _lock:
+        idle = _pools.get(key)
+        if idle:
+            conn = idle.pop()
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+            conn.timeout = timeout
+            return conn, True
+    scheme, host, port = key
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=timeout), False
+    return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+def _release(key, conn):
+    with _lock:
+        idle = _pools.setdefault(key, [])
+        if len(idle) < HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+def close_all():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for idle in pools:
+        for conn in idle:
+            conn.close()
+
+def request(method, url, body=None, headers=None, timeout=None):
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    send_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+    send_headers.update(headers or {})
+    timeout = HTTP_TIMEOUT if timeout is None else timeout
+    started = time.perf_counter()
+
+    while True:
+        conn, reused = _acquire(key, timeout)
+        try:
+            conn.request(method, path, body=body, headers=send_headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except _STALE_ERRORS:
+            conn.close()
+            if reused:
+                continue
+            observe_response(parts.hostname, "error", started)
+            raise
+        except Exception:
+            conn.close()
+            observe_response(parts.hostname, "error", started)
+            raise
+        break
+    observe_response(parts.hostname, str(resp.status), started)
+
+    if resp.will_close:
+        conn.close()
+    else:
+        _release(key, conn)
+
+    if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+        data = gzip.decompress(data)
+    if resp.status >= 400:
+        raise response_error(resp.status, data, dict(resp.getheaders()))
+    return data
+
+def get_json(url, timeout=None):
+    return json.loads(request("GET", url, timeout=timeout).decode("utf-8"))
+
+def post_form(url, data, timeout=None):
+    payload = urllib.parse.urlencode(data).encode("utf-8")
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    return json.loads(request("POST", url, body=payload, headers=headers, timeout=timeout).decode("utf-8"))
@@ -0,0 +1,90 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from database import set_upload_renditions
+import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IG_MIN_RATIO = 4 / 5
+IG_MAX_RATIO = 1.91
+IG_MIN_WIDTH = 320
+IG_MAX_WIDTH = 1440
+IG_JPEG_QUALITY = 90
+THUMB_SIZE = 320
+THUMB_WEBP_QUALITY = 75
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+def _flatten(img):
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def _fit_instagram(img):
+    width, height = img.size
+    ratio = width / height
+    if ratio < IG_MIN_RATIO:
+        new_height = int(width / IG_MIN_RATIO)
+        top = (height - new_height) // 2
+        img = img.crop((0, top, width, top + new_height))
+    elif ratio > IG_MAX_RATIO:
+        new_width = int(height * IG_MAX_RATIO)
+        left = (width - new_width) // 2
+        img = img.crop((left, 0, left + new_width, height))
+    width, height = img.size
+    target_width = min(max(width, IG_MIN_WIDTH), IG_MAX_WIDTH)
+    if target_width != width:
+        img = img.resize((target_width, round(height * target_width / width)), Image.LANCZOS)
+    return img
+
+def render_renditions(source_path, publish_path, thumb_path):
+    with Image.open(source_path) as original:
+        img = _flatten(original)
+    _fit_instagram(img).save(publish_path, "JPEG", quality=IG_JPEG_QUALITY, optimize=True, progressive=True)
+    img.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+    img.save(thumb_path, "WEBP", quality=THUMB_WEBP_QUALITY, method=4)
+
+def _on_rendered(future, sha256, publish_url, thumb_url):
+    exc = future.exception()
+    if exc:
+        print(f"⚠️ Falha ao processar imagem {sha256}: {exc}")
+        return
+    set_upload_renditions(sha256, publish_url, thumb_url)
+
+def generate_renditions(sha256, filename, build_url):
+    if Image is None or IMAGE_WORKERS <= 0:
+        return None
+    publish_name, thumb_name = storage.rendition_filenames(sha256)
+    publish_path = os.path.join(storage.UPLOAD_FOLDER, publish_name)
+    thumb_path = os.path.join(storage.UPLOAD_FOLDER, thumb_name)
+    publish_url = build_url(publish_name)
+    thumb_url = build_url(thumb_name)
+    if os.path.exists(publish_path) and os.path.exists(thumb_path):
+        set_upload_renditions(sha256, publish_url, thumb_url)
+        return None
+    future = _get_executor().submit(
+        render_renditions,
+        os.path.join(storage.UPLOAD_FOLDER, filename),
+        publish_path,
+        thumb_path
+    )
+    future.add_done_callback(lambda done: _on_rendered(done, sha256, publish_url, thumb_url))
+    return future
@@ -1,4 +1,31 @@
-from app import run_app
+import os
+import sys
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description="instaSchedule")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("web", help="servidor de desenvolvimento Flask (padrão)")
+    commands.add_parser("serve", help="servidor de produção (gunicorn, configurado por variáveis de ambiente)")
+    scheduler_parser = commands.add_parser("scheduler", help="processos do agendador")
+    scheduler_parser.add_argument("action", choices=["worker"])
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        root = os.path.dirname(os.path.abspath(__file__))
+        os.environ.setdefault("EMBEDDED_SCHEDULER", "0")
+        os.execvp(sys.executable, [
+            sys.executable, "-m", "gunicorn",
+            "--chdir", root,
+            "-c", os.path.join(root, "gunicorn.conf.py"),
+            "wsgi:application"
+        ])
+    elif args.command == "scheduler":
+        from scheduler import run_worker
+        run_worker()
+    else:
+        from app import run_app
+        run_app()
 
 if __name__ == "__main__":
-    run_app()
+    main()
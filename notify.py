@@ -1,2 +1,148 @@
-def notify(message):
-    print(f"[NOTIFICAÇÃO] {message}")
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from metrics import counter, gauge
+
+NOTIFY_SINKS = os.environ.get("NOTIFY_SINKS", "stdout")
+NOTIFY_QUEUE_SIZE = int(os.environ.get("NOTIFY_QUEUE_SIZE", "10000"))
+NOTIFY_WINDOW_SECONDS = float(os.environ.get("NOTIFY_WINDOW_SECONDS", "30"))
+NOTIFY_MAX_DIGEST = int(os.environ.get("NOTIFY_MAX_DIGEST", "100"))
+
+_queue = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+_sinks = []
+_thread = None
+_thread_lock = threading.Lock()
+
+notify_events_total = counter("notify_events_total", "Notificações enfileiradas")
+notify_dropped_total = counter("notify_dropped_total", "Notificações descartadas com a fila cheia")
+notify_sent_total = counter("notify_sent_total", "Resumos entregues por destino", ("sink",))
+notify_sink_errors_total = counter("notify_sink_errors_total", "Falhas de entrega por destino", ("sink",))
+gauge("notify_queue_depth", "Notificações aguardando o despachante", _queue.qsize)
+
+def format_digest(digest):
+    messages = digest["messages"]
+    if len(messages) == 1:
+        return f"[NOTIFICAÇÃO] {messages[0]}"
+    account = f" (conta {digest['account']})" if digest["account"] else ""
+    lines = [f"[NOTIFICAÇÃO] {len(messages)} falhas{account} desde {digest['since']}:"]
+    lines += [f"  - {message}" for message in messages]
+    return "\n".join(lines)
+
+def stdout_sink(digest):
+    print(format_digest(digest))
+
+def file_sink(path):
+    lock = threading.Lock()
+
+    def send(digest):
+        with lock, open(path, "a", encoding="utf-8") as sink_file:
+            sink_file.write(json.dumps(digest, ensure_ascii=False) + "\n")
+    send.__name__ = "file"
+    return send
+
+def webhook_sink(url):
+    from http_client import request
+
+    def send(digest):
+        payload = dict(digest, text=format_digest(digest))
+        request(
+            "POST",
+            url,
+            json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            {"Content-Type": "application/json"}
+        )
+    send.__name__ = "webhook"
+    return send
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+def _configure_sinks(spec):
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, target = entry.partition(":")
+        if kind == "stdout":
+            add_sink(stdout_sink)
+        elif kind == "file":
+            add_sink(file_sink(target))
+        elif kind == "webhook":
+            add_sink(webhook_sink(target))
+        else:
+            print(f"⚠️ Destino de notificação desconhecido: {entry}")
+
+def _deliver(key, messages, since):
+    digest = {"account": key, "since": since, "count": len(messages), "messages": messages}
+    for sink in list(_sinks):
+        name = getattr(sink, "__name__", "sink").replace("_sink", "")
+        try:
+            sink(digest)
+        except Exception as exc:
+            notify_sink_errors_total.inc(name)
+            print(f"⚠️ Falha ao entregar notificação via {name}: {exc}")
+        else:
+            notify_sent_total.inc(name)
+
+def _dispatcher():
+    pending = {}
+    while True:
+        timeout = None
+        if pending:
+            oldest = min(started for started, _, _ in pending.values())
+            timeout = max(0.0, oldest + NOTIFY_WINDOW_SECONDS - time.monotonic())
+        try:
+            item = _queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        flush = None
+        if isinstance(item, threading.Event):
+            flush = item
+        elif item is not None:
+            key, message = item
+            entry = pending.setdefault(
+                key, (time.monotonic(), datetime.now().isoformat(timespec="seconds"), [])
+            )
+            entry[2].append(message)
+
+        now = time.monotonic()
+        for key, (started, since, messages) in list(pending.items()):
+            if flush or now >= started + NOTIFY_WINDOW_SECONDS or len(messages) >= NOTIFY_MAX_DIGEST:
+                del pending[key]
+                _deliver(key, messages, since)
+        if flush:
+            flush.set()
+
+def _ensure_dispatcher():
+    global _thread
+    if _thread:
+        return
+    with _thread_lock:
+        if _thread:
+            return
+        if not _sinks:
+            _configure_sinks(NOTIFY_SINKS)
+        _thread = threading.Thread(target=_dispatcher, name="notify-dispatcher", daemon=True)
+        _thread.start()
+        atexit.register(flush)
+
+def notify(message, account=None):
+    _ensure_dispatcher()
+    try:
+        _queue.put_nowait((account, message))
+    except queue.Full:
+        notify_dropped_total.inc()
+        return
+    notify_events_total.inc()
+
+def flush(timeout=5):
+    if not _thread:
+        return
+    done = threading.Event()
+    try:
+        _queue.put(done, timeout=timeout)
+    except queue.Full:
+        return
+    done.wait(timeout)
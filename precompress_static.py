@@ -0,0 +1,41 @@
+import os
+import gzip
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt"}
+
+def precompress(folder=STATIC_FOLDER):
+    written = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if name != "uploads"]
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as source:
+                data = source.read()
+            variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as target:
+                    target.write(compressed)
+                written.append(path + suffix)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera variantes .gz/.br dos arquivos estáticos")
+    parser.add_argument("--folder", default=STATIC_FOLDER)
+    args = parser.parse_args()
+    for path in precompress(args.folder):
+        print(path)
+    if brotli is None:
+        print("brotli não instalado: apenas variantes gzip foram geradas.")
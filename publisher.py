@@ -1,22 +1,53 @@
-import json
-import urllib.request
-import urllib.parse
-from database import connect, get_account_by_id
-from notify import notify
-
-def _post_form(url, data):
-    payload = urllib.parse.urlencode(data).encode("utf-8")
-    req = urllib.request.Request(url, data=payload)
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from database import (
+    get_account_by_id,
+    get_post_for_publish,
+    mark_accounts_token_invalid,
+    mark_posts_published,
+    set_post_container
+)
+from http_client import HttpError, post_form as _post_form
+from metrics import publish_lag_seconds, publish_total
+from retry import record_failures
+from tokens import check_account_token, is_token_error, mark_dead
 
-def publish_to_instagram(account, image_url, caption):
+GRAPH_API_BASE = os.environ.get("GRAPH_API_BASE", "https://graph.facebook.com/v19.0")
+PRESTAGE_MINUTES = int(os.environ.get("PRESTAGE_MINUTES", "10"))
+CONTAINER_TTL_HOURS = float(os.environ.get("CONTAINER_TTL_HOURS", "23"))
+
+EXPIRED_CONTAINER_ERRORS = {(24, 2207008), (100, 33)}
+
+publish_lags = deque(maxlen=1000)
+
+def _lag_seconds(scheduled_at):
+    try:
+        scheduled = datetime.fromisoformat(scheduled_at)
+    except (TypeError, ValueError):
+        return None
+    return (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()
+
+def is_container_expired(exc):
+    if not isinstance(exc, HttpError):
+        return False
+    error = exc.graph_error
+    return (error.get("code"), error.get("error_subcode")) in EXPIRED_CONTAINER_ERRORS
+
+def container_expiry_cutoff():
+    return (datetime.now() - timedelta(hours=CONTAINER_TTL_HOURS)).isoformat(timespec="seconds")
+
+def _account_credentials(account):
     ig_user_id = account[3]
     access_token = account[4]
     if not ig_user_id or not access_token:
         raise ValueError("Conta sem ig_user_id/access_token")
+    return ig_user_id, access_token
+
+def create_container(account, image_url, caption):
+    ig_user_id, access_token = _account_credentials(account)
     container = _post_form(
-        f"https://graph.facebook.com/v19.0/{ig_user_id}/media",
+        f"{GRAPH_API_BASE}/{ig_user_id}/media",
         {
             "image_url": image_url,
             "caption": caption or "",
@@ -26,38 +57,76 @@ def publish_to_instagram(account, image_url, caption):
     creation_id = container.get("id")
     if not creation_id:
         raise ValueError("Falha ao criar container")
-    publish = _post_form(
-        f"https://graph.facebook.com/v19.0/{ig_user_id}/media_publish",
+    return creation_id
+
+def publish_container(account, creation_id):
+    ig_user_id, access_token = _account_credentials(account)
+    return _post_form(
+        f"{GRAPH_API_BASE}/{ig_user_id}/media_publish",
         {
             "creation_id": creation_id,
             "access_token": access_token
         }
     )
-    return publish
 
-def publish_post(post_id):
-    conn = connect()
-    c = conn.cursor()
+def publish_to_instagram(account, image_url, caption):
+    creation_id = create_container(account, image_url, caption)
+    return publish_container(account, creation_id)
 
-    c.execute("SELECT id, caption, image_url, account_id FROM posts WHERE id = ?", (post_id,))
-    post = c.fetchone()
+def stage_post(post_id, caption, image_url, account_id):
+    account = get_account_by_id(None, account_id)
+    if not account:
+        return
+    try:
+        check_account_token(account)
+        creation_id = create_container(account, image_url, caption)
+    except Exception as exc:
+        if is_token_error(exc):
+            mark_dead(account[4], str(exc))
+            mark_accounts_token_invalid([account_id])
+        print(f"⚠️ Falha ao preparar container do post {post_id}: {exc}")
+        return
+    staged_at = datetime.now().isoformat(timespec="seconds")
+    set_post_container(post_id, creation_id, staged_at, caption, image_url, account_id)
+
+def publish_post(post_id):
+    post = get_post_for_publish(post_id)
     if not post:
-        conn.close()
         return
 
-    post_id, caption, image_url, account_id = post
+    post_id, caption, image_url, account_id, scheduled_at, creation_id, staged_at, attempts, user_id = post[:9]
+    account = post[9:] if post[9] is not None else None
     try:
         if account_id:
-            account = get_account_by_id(None, account_id)
             if account:
                 if not image_url:
                     raise ValueError("Post sem image_url")
-                publish_to_instagram(account, image_url, caption)
-        c.execute("UPDATE posts SET status = ? WHERE id = ?", ("Publicado", post_id))
+                check_account_token(account)
+                if creation_id and staged_at and staged_at >= container_expiry_cutoff():
+                    try:
+                        publish_container(account, creation_id)
+                    except HttpError as exc:
+                        if not is_container_expired(exc):
+                            raise
+                        print(f"⚠️ Container {creation_id} do post {post_id} inválido, recriando: {exc}")
+                        publish_to_instagram(account, image_url, caption)
+                else:
+                    publish_to_instagram(account, image_url, caption)
     except Exception as exc:
-        notify(f"Falha ao publicar post {post_id}: {exc}")
+        if account and is_token_error(exc):
+            mark_dead(account[4], str(exc))
+            mark_accounts_token_invalid([account_id])
+        publish_total.inc("failed")
+        record_failures([(post_id, attempts, account_id, account[3] if account else None, exc)])
+        return
 
-    conn.commit()
-    conn.close()
+    mark_posts_published([post_id])
+    publish_total.inc("published")
 
-    print(f"✅ Post {post_id} publicado")
+    lag = _lag_seconds(scheduled_at)
+    if lag is not None:
+        publish_lags.append((post_id, lag, user_id))
+        publish_lag_seconds.observe(max(lag, 0))
+        print(f"✅ Post {post_id} publicado ({lag:.1f}s após o horário)")
+    else:
+        print(f"✅ Post {post_id} publicado")
@@ -0,0 +1,33 @@
+import os
+import threading
+import time
+
+ACCOUNT_RATE_PER_MINUTE = float(os.environ.get("ACCOUNT_RATE_PER_MINUTE", "30"))
+ACCOUNT_BURST = int(os.environ.get("ACCOUNT_BURST", "5"))
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def penalize(self, key, seconds):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            self._buckets[key] = (min(tokens, 1 - seconds * self.rate), now)
+
+limiter = TokenBucket(ACCOUNT_RATE_PER_MINUTE / 60.0, ACCOUNT_BURST)
@@ -0,0 +1,91 @@
+import os
+import random
+import http.client
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from database import mark_posts_failed, mark_posts_retry
+from http_client import HttpError
+from metrics import counter
+from notify import notify
+from ratelimit import limiter
+from tokens import TOKEN_RECHECK_SECONDS, TokenInvalidError, is_token_error
+
+MAX_PUBLISH_ATTEMPTS = int(os.environ.get("MAX_PUBLISH_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.environ.get("RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.environ.get("RETRY_MAX_SECONDS", "3600"))
+THROTTLE_BACKOFF_SECONDS = float(os.environ.get("THROTTLE_BACKOFF_SECONDS", "300"))
+
+THROTTLE_CODES = {4, 17, 32, 613}
+TRANSIENT_CODES = {1, 2}
+RETRYABLE_STATUSES = {408, 425, 429}
+
+publish_retries_total = counter("publish_retries_total", "Falhas de publicação por decisão", ("decision",))
+
+def retry_after_seconds(exc):
+    headers = {str(name).lower(): value for name, value in (exc.headers or {}).items()}
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(when.tzinfo)).total_seconds())
+
+def classify(exc):
+    if isinstance(exc, TokenInvalidError) or is_token_error(exc):
+        return True, False, TOKEN_RECHECK_SECONDS
+    if isinstance(exc, HttpError):
+        error = exc.graph_error
+        code = error.get("code")
+        throttled = exc.status == 429 or code in THROTTLE_CODES
+        retryable = (
+            throttled
+            or exc.status >= 500
+            or exc.status in RETRYABLE_STATUSES
+            or code in TRANSIENT_CODES
+            or error.get("is_transient") is True
+        )
+        return retryable, throttled, retry_after_seconds(exc)
+    if isinstance(exc, (OSError, EOFError, TimeoutError, http.client.HTTPException)):
+        return True, False, None
+    return False, False, None
+
+def backoff_seconds(attempt, retry_after=None, throttled=False):
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = random.uniform(delay / 2, delay)
+    if throttled:
+        delay = max(delay, random.uniform(THROTTLE_BACKOFF_SECONDS, THROTTLE_BACKOFF_SECONDS * 1.5))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+def record_failures(failures):
+    retries = []
+    dead = []
+    now = datetime.now()
+    for post_id, attempts, account_id, ig_user_id, exc in failures:
+        attempt = (attempts or 0) + 1
+        retryable, throttled, retry_after = classify(exc)
+        if throttled and ig_user_id:
+            limiter.penalize(ig_user_id, retry_after or THROTTLE_BACKOFF_SECONDS)
+        if retryable and attempt < MAX_PUBLISH_ATTEMPTS:
+            delay = backoff_seconds(attempt, retry_after, throttled)
+            next_attempt_at = (now + timedelta(seconds=delay)).isoformat(timespec="seconds")
+            decision = "throttled" if throttled else "retry"
+            retries.append((post_id, next_attempt_at, str(exc)[:500], decision, round(delay, 1)))
+            publish_retries_total.inc(decision)
+            print(f"🔁 Post {post_id}: tentativa {attempt}/{MAX_PUBLISH_ATTEMPTS} falhou, nova tentativa em {delay:.0f}s: {exc}")
+        else:
+            decision = "dead" if retryable else "fatal"
+            dead.append((post_id, str(exc)[:500], decision))
+            publish_retries_total.inc(decision)
+            notify(f"Falha ao publicar post {post_id} após {attempt} tentativa(s): {exc}", account_id)
+    if retries:
+        mark_posts_retry(retries)
+    if dead:
+        mark_posts_failed(dead)
@@ -1,22 +1,212 @@
 import os
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
-from publisher import publish_post
+import time
+import uuid
+import atexit
+import signal
+import socket
+import threading
+from functools import wraps
+from datetime import datetime, timedelta
+from database import (
+    acquire_lease,
+    claim_due_posts,
+    claim_post,
+    archive_published_posts,
+    claim_retry_posts,
+    compact_database,
+    create_tables,
+    get_posts_to_stage,
+    has_posts_due,
+    prune_post_events,
+    recover_stale_claims,
+    release_lease
+)
+from publisher import PRESTAGE_MINUTES, container_expiry_cutoff, stage_post
+from metrics import gauge
+from storage import collect_orphan_uploads
+from tokens import refresh_expiring_tokens
+from workers import pending, submit
 
-scheduler = BackgroundScheduler()
+SCHEDULER_MODE = os.environ.get("SCHEDULER_MODE", "jobs")
+EMBEDDED_SCHEDULER = os.environ.get("EMBEDDED_SCHEDULER", "1") == "1"
+PUBLISH_ENGINE = os.environ.get("PUBLISH_ENGINE", "threads")
+DISPATCH_INTERVAL = int(os.environ.get("DISPATCH_INTERVAL", "5"))
+DISPATCH_BATCH_SIZE = int(os.environ.get("DISPATCH_BATCH_SIZE", "100"))
+STAGE_INTERVAL = int(os.environ.get("STAGE_INTERVAL", "60"))
+STAGE_BATCH_SIZE = int(os.environ.get("STAGE_BATCH_SIZE", "50"))
+UPLOAD_GC_INTERVAL = int(os.environ.get("UPLOAD_GC_INTERVAL", "3600"))
+RETRY_INTERVAL = int(os.environ.get("RETRY_INTERVAL", "15"))
+RETRY_BATCH_SIZE = int(os.environ.get("RETRY_BATCH_SIZE", "50"))
+LEASE_TTL = int(os.environ.get("SCHEDULER_LEASE_TTL", "30"))
+LEASE_RENEW_INTERVAL = int(os.environ.get("SCHEDULER_LEASE_RENEW_INTERVAL", "10"))
+CLAIM_TIMEOUT = int(os.environ.get("CLAIM_TIMEOUT", "1800"))
+RECOVERY_INTERVAL = int(os.environ.get("RECOVERY_INTERVAL", "60"))
+MISSED_JOB_GRACE = int(os.environ.get("MISSED_JOB_GRACE", "60"))
+WORKER_SHUTDOWN_TIMEOUT = int(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", "30"))
+TOKEN_REFRESH_INTERVAL = int(os.environ.get("TOKEN_REFRESH_INTERVAL", "3600"))
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_MAX_BATCHES = int(os.environ.get("ARCHIVE_MAX_BATCHES", "20"))
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", "900"))
+QUIET_WINDOW_MINUTES = int(os.environ.get("QUIET_WINDOW_MINUTES", "10"))
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "2000"))
+POST_EVENTS_RETENTION = int(os.environ.get("POST_EVENTS_RETENTION", "3600"))
+
+LEASE_NAME = "scheduler"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_lease_valid_until = 0.0
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from apscheduler.schedulers.background import BackgroundScheduler
+                _scheduler = BackgroundScheduler()
+    return _scheduler
+
+def is_leader():
+    return time.monotonic() < _lease_valid_until
+
+gauge("scheduler_jobs", "Jobs registrados no APScheduler", lambda: len(_scheduler.get_jobs()) if _scheduler else 0)
+gauge("scheduler_leader", "1 se este processo detém o lease do agendador", lambda: int(is_leader()))
+
+def renew_lease():
+    global _lease_valid_until
+    started = time.monotonic()
+    if acquire_lease(LEASE_NAME, WORKER_ID, LEASE_TTL):
+        if not is_leader():
+            print(f"👑 {WORKER_ID} assumiu o agendador")
+        _lease_valid_until = started + LEASE_TTL
+    else:
+        _lease_valid_until = 0.0
+
+def _release_lease():
+    global _lease_valid_until
+    if is_leader():
+        _lease_valid_until = 0.0
+        release_lease(LEASE_NAME, WORKER_ID)
+
+def _leader_only(fn):
+    @wraps(fn)
+    def wrapper():
+        if is_leader():
+            fn()
+    return wrapper
+
+def _add_leader_job(fn, seconds, job_id):
+    get_scheduler().add_job(
+        _leader_only(fn),
+        "interval",
+        seconds=seconds,
+        id=job_id,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
 
 def start_scheduler(debug=False):
-    if scheduler.running:
+    if not EMBEDDED_SCHEDULER or get_scheduler().running:
         return
     if debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
         return
-    scheduler.start()
+    get_scheduler().add_job(
+        renew_lease,
+        "interval",
+        seconds=LEASE_RENEW_INTERVAL,
+        id="lease",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now()
+    )
+    if SCHEDULER_MODE == "dispatcher":
+        _add_leader_job(dispatch_due_posts, DISPATCH_INTERVAL, "dispatcher")
+    else:
+        _add_leader_job(dispatch_missed_posts, MISSED_JOB_GRACE, "missed")
+    _add_leader_job(retry_due_posts, RETRY_INTERVAL, "retrier")
+    _add_leader_job(recover_stale_posts, RECOVERY_INTERVAL, "recovery")
+    if PRESTAGE_MINUTES > 0:
+        _add_leader_job(stage_upcoming_posts, STAGE_INTERVAL, "stager")
+    _add_leader_job(collect_orphan_uploads, UPLOAD_GC_INTERVAL, "upload_gc")
+    _add_leader_job(refresh_expiring_tokens, TOKEN_REFRESH_INTERVAL, "token_refresh")
+    _add_leader_job(maintain_database, MAINTENANCE_INTERVAL, "maintenance")
+    get_scheduler().start()
+    atexit.register(_release_lease)
+
+def _publish_claimed(post_ids):
+    if PUBLISH_ENGINE == "async":
+        from async_publisher import publish_posts
+        publish_posts(post_ids)
+    else:
+        for post_id in post_ids:
+            submit(post_id)
+
+def dispatch_due_posts(due_before=None):
+    while True:
+        now = due_before or datetime.now().isoformat(timespec="seconds")
+        post_ids = claim_due_posts(now, DISPATCH_BATCH_SIZE, WORKER_ID)
+        _publish_claimed(post_ids)
+        if len(post_ids) < DISPATCH_BATCH_SIZE:
+            break
+
+def dispatch_missed_posts():
+    dispatch_due_posts((datetime.now() - timedelta(seconds=MISSED_JOB_GRACE)).isoformat(timespec="seconds"))
+
+def retry_due_posts():
+    now = datetime.now().isoformat(timespec="seconds")
+    _publish_claimed(claim_retry_posts(now, RETRY_BATCH_SIZE, WORKER_ID))
+
+def recover_stale_posts():
+    now = datetime.now()
+    claimed_before = (now - timedelta(seconds=CLAIM_TIMEOUT)).isoformat(timespec="seconds")
+    recovered = recover_stale_claims(claimed_before, now.isoformat(timespec="seconds"), DISPATCH_BATCH_SIZE)
+    if recovered:
+        print(f"♻️ {recovered} post(s) presos em Publicando voltaram para nova tentativa")
+
+def maintain_database():
+    before = (datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat(timespec="seconds")
+    archived = 0
+    for _ in range(ARCHIVE_MAX_BATCHES if ARCHIVE_AFTER_DAYS > 0 else 0):
+        moved = archive_published_posts(before, ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+        time.sleep(0.05)
+    if archived:
+        print(f"🗄️ {archived} post(s) publicados movidos para o arquivo")
+    prune_post_events(int(time.time()) - POST_EVENTS_RETENTION)
+    quiet_until = (datetime.now() + timedelta(minutes=QUIET_WINDOW_MINUTES)).isoformat(timespec="seconds")
+    if pending() == 0 and not has_posts_due(quiet_until):
+        compact_database(VACUUM_PAGES)
+
+def publish_scheduled_post(post_id):
+    now = datetime.now().isoformat(timespec="seconds")
+    if claim_post(post_id, now, WORKER_ID):
+        _publish_claimed([post_id])
+
+def stage_upcoming_posts():
+    now = datetime.now()
+    until = now + timedelta(minutes=PRESTAGE_MINUTES)
+    posts = get_posts_to_stage(
+        now.isoformat(timespec="seconds"),
+        until.isoformat(timespec="seconds"),
+        container_expiry_cutoff(),
+        STAGE_BATCH_SIZE
+    )
+    for post_id, caption, image_url, account_id in posts:
+        stage_post(post_id, caption, image_url, account_id)
 
 def schedule_post(post_id, data):
     start_scheduler()
+    if SCHEDULER_MODE == "dispatcher" or not EMBEDDED_SCHEDULER:
+        return
     run_date = datetime.fromisoformat(data["scheduled_at"])
-    scheduler.add_job(
-        publish_post,
+    get_scheduler().add_job(
+        publish_scheduled_post,
         "date",
         run_date=run_date,
         args=[post_id],
@@ -24,9 +214,48 @@ def schedule_post(post_id, data):
         replace_existing=True
     )
 
+def schedule_posts(items):
+    start_scheduler()
+    if SCHEDULER_MODE == "dispatcher" or not EMBEDDED_SCHEDULER or not items:
+        return
+    scheduler = get_scheduler()
+    scheduler.pause()
+    try:
+        for post_id, data in items:
+            scheduler.add_job(
+                publish_scheduled_post,
+                "date",
+                run_date=datetime.fromisoformat(data["scheduled_at"]),
+                args=[post_id],
+                id=f"post_{post_id}",
+                replace_existing=True
+            )
+    finally:
+        scheduler.resume()
+
 def cancel_post(post_id):
     start_scheduler()
+    if SCHEDULER_MODE == "dispatcher" or not EMBEDDED_SCHEDULER:
+        return
     try:
-        scheduler.remove_job(f"post_{post_id}")
+        get_scheduler().remove_job(f"post_{post_id}")
     except Exception:
         pass
+
+def run_worker():
+    global SCHEDULER_MODE, EMBEDDED_SCHEDULER
+    SCHEDULER_MODE = "dispatcher"
+    EMBEDDED_SCHEDULER = True
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    create_tables()
+    start_scheduler()
+    print(f"🕒 Worker do agendador {WORKER_ID} iniciado")
+    stop.wait()
+    get_scheduler().shutdown(wait=True)
+    deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+    while pending() and time.monotonic() < deadline:
+        time.sleep(0.5)
+    _release_lease()
+    print(f"🕒 Worker do agendador {WORKER_ID} encerrado")
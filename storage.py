@@ -0,0 +1,57 @@
+import os
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+from database import register_upload, get_orphan_uploads, delete_upload
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+RENDITION_SUFFIXES = ("_ig.jpg", "_thumb.webp")
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ORPHAN_GRACE_SECONDS = int(os.environ.get("ORPHAN_GRACE_SECONDS", "3600"))
+
+def rendition_filenames(sha256):
+    return tuple(f"{sha256}{suffix}" for suffix in RENDITION_SUFFIXES)
+
+def store_upload(stream, ext, build_url):
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+        filename = f"{sha256}{ext}"
+        filename, url = register_upload(sha256, filename, build_url(filename), size)
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256, filename, url
+
+def collect_orphan_uploads(limit=500):
+    cutoff = (datetime.utcnow() - timedelta(seconds=ORPHAN_GRACE_SECONDS)).isoformat()
+    removed = 0
+    for sha256, filename in get_orphan_uploads(cutoff, limit):
+        names = (filename,) + rendition_filenames(sha256)
+        if delete_upload(sha256, cutoff, lambda: _remove_files(names)):
+            removed += 1
+    return removed
+
+def _remove_files(names):
+    for name in names:
+        try:
+            os.remove(os.path.join(UPLOAD_FOLDER, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+import urllib.parse
+from datetime import datetime
+from database import get_accounts_expiring, mark_accounts_token_invalid, update_account_token
+from http_client import HttpError, get_json
+from metrics import counter
+from notify import notify
+
+GRAPH_API_BASE = os.environ.get("GRAPH_API_BASE", "https://graph.facebook.com/v19.0")
+FB_APP_ID = os.environ.get("FB_APP_ID")
+FB_APP_SECRET = os.environ.get("FB_APP_SECRET")
+TOKEN_REFRESH_WINDOW_DAYS = float(os.environ.get("TOKEN_REFRESH_WINDOW_DAYS", "7"))
+TOKEN_REFRESH_BATCH_SIZE = int(os.environ.get("TOKEN_REFRESH_BATCH_SIZE", "50"))
+TOKEN_RECHECK_SECONDS = int(os.environ.get("TOKEN_RECHECK_SECONDS", "1800"))
+
+INVALID_TOKEN_CODES = {190}
+
+token_refresh_total = counter("token_refresh_total", "Renovações de token por resultado", ("result",))
+
+_dead = {}
+_dead_lock = threading.Lock()
+
+class TokenInvalidError(Exception):
+    pass
+
+def token_expiry(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+def is_token_error(exc):
+    return isinstance(exc, HttpError) and exc.graph_error.get("code") in INVALID_TOKEN_CODES
+
+def mark_dead(access_token, reason):
+    with _dead_lock:
+        _dead[access_token] = (time.monotonic() + TOKEN_RECHECK_SECONDS, f"Token inválido: {reason}")
+
+def token_problem(access_token, expires_at):
+    with _dead_lock:
+        entry = _dead.get(access_token)
+        if entry and entry[0] <= time.monotonic():
+            del _dead[access_token]
+            entry = None
+    if entry:
+        return entry[1]
+    expiry = token_expiry(expires_at)
+    if expiry is not None and expiry < time.time():
+        return f"Token expirou em {datetime.fromtimestamp(expiry).isoformat(timespec='seconds')}"
+    return None
+
+def check_account_token(account):
+    if account[7]:
+        raise TokenInvalidError(f"Token invalidado em {account[7]}; reconecte a conta")
+    problem = token_problem(account[4], account[5])
+    if problem:
+        raise TokenInvalidError(problem)
+
+def exchange_token(access_token):
+    response = get_json(f"{GRAPH_API_BASE}/oauth/access_token?" + urllib.parse.urlencode({
+        "grant_type": "fb_exchange_token",
+        "client_id": FB_APP_ID,
+        "client_secret": FB_APP_SECRET,
+        "fb_exchange_token": access_token
+    }))
+    new_token = response.get("access_token")
+    if not new_token:
+        raise ValueError("Resposta sem access_token")
+    expires_in = response.get("expires_in")
+    expires_at = str(time.time() + int(expires_in)) if expires_in else None
+    return new_token, expires_at
+
+def refresh_expiring_tokens():
+    if not FB_APP_ID or not FB_APP_SECRET:
+        return
+    now = time.time()
+    accounts = get_accounts_expiring(now, now + TOKEN_REFRESH_WINDOW_DAYS * 86400, TOKEN_REFRESH_BATCH_SIZE)
+    by_token = {}
+    for account_id, access_token, _ in accounts:
+        by_token.setdefault(access_token, []).append(account_id)
+
+    for access_token, owners in by_token.items():
+        if token_problem(access_token, None):
+            continue
+        try:
+            new_token, expires_at = exchange_token(access_token)
+        except Exception as exc:
+            if is_token_error(exc):
+                mark_dead(access_token, str(exc))
+                mark_accounts_token_invalid(owners)
+                token_refresh_total.inc("dead")
+                for account_id in owners:
+                    notify(f"Token da conta {account_id} foi invalidado; reconecte a conta: {exc}", account_id)
+            else:
+                token_refresh_total.inc("error")
+                print(f"⚠️ Falha ao renovar token de {len(owners)} conta(s): {exc}")
+            continue
+        for account_id in owners:
+            update_account_token(account_id, new_token, expires_at)
+        token_refresh_total.inc("refreshed")
@@ -0,0 +1,93 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from database import get_post_ig_user_id
+from publisher import publish_post, publish_lags
+from metrics import gauge
+from ratelimit import limiter
+
+PUBLISH_WORKERS = int(os.environ.get("PUBLISH_WORKERS", "8"))
+
+_queue = []
+_sequence = itertools.count()
+_cond = threading.Condition()
+_threads = []
+_in_flight = 0
+
+def start_workers():
+    with _cond:
+        if _threads:
+            return
+        for i in range(PUBLISH_WORKERS):
+            thread = threading.Thread(target=_worker, name=f"publisher-{i}", daemon=True)
+            thread.start()
+            _threads.append(thread)
+
+def submit(post_id, ready_at=None):
+    if PUBLISH_WORKERS <= 0:
+        publish_post(post_id)
+        return
+    start_workers()
+    with _cond:
+        heapq.heappush(_queue, (ready_at or time.monotonic(), next(_sequence), post_id))
+        _cond.notify()
+
+def queue_depth():
+    with _cond:
+        return len(_queue)
+
+def pending():
+    with _cond:
+        return len(_queue) + _in_flight
+
+def stats(user_id):
+    entries = [(post_id, lag) for post_id, lag, owner in list(publish_lags) if owner == user_id]
+    lags = [lag for _, lag in entries]
+    return {
+        "workers": PUBLISH_WORKERS,
+        "queue_depth": queue_depth(),
+        "lag": {
+            "count": len(lags),
+            "avg": sum(lags) / len(lags) if lags else None,
+            "max": max(lags) if lags else None,
+            "recent": [{"post_id": post_id, "seconds": lag} for post_id, lag in entries[-20:]]
+        }
+    }
+
+gauge("publish_queue_depth", "Posts aguardando um worker de publicação", queue_depth)
+gauge("publish_in_flight", "Posts sendo publicados por um worker", lambda: _in_flight)
+
+def _next_post_id():
+    global _in_flight
+    with _cond:
+        while True:
+            if not _queue:
+                _cond.wait()
+                continue
+            delay = _queue[0][0] - time.monotonic()
+            if delay <= 0:
+                _in_flight += 1
+                return heapq.heappop(_queue)[2]
+            _cond.wait(delay)
+
+def _finished():
+    global _in_flight
+    with _cond:
+        _in_flight -= 1
+
+def _worker():
+    while True:
+        post_id = _next_post_id()
+        try:
+            ig_user_id = get_post_ig_user_id(post_id)
+            wait = limiter.take(ig_user_id) if ig_user_id else 0
+            if wait > 0:
+                submit(post_id, time.monotonic() + wait)
+                continue
+            publish_post(post_id)
+        except Exception as exc:
+            print(f"❌ Erro no worker ao publicar post {post_id}: {exc}")
+        finally:
+            _finished()
@@ -0,0 +1,7 @@
+import os
+
+os.environ.setdefault("EMBEDDED_SCHEDULER", "0")
+
+from app import app
+
+application = app